@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import ast
+import contextlib
+import glob
+import inspect
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+import zlib
+from typing import Any, Awaitable, Callable
+
+from . import synthetic
+
+# python -m benchmarks.pipeline --scale 1 10 --workers 4 --concurrency 1 4 8 --output bench.json
+# Everything runs offline: sizes are synthetic, base versions come from checksums/ and the schemas are served from
+# localhost.  Pass --template with a release .apworld to take the path where the upload matches its base version.
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the manual_checker pipeline")
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--locations", type=int, default=500)
+    parser.add_argument("--regions", type=int, default=50)
+    parser.add_argument("--hooks", type=int, default=20, help="synthetic rule functions added on top of the release hooks")
+    parser.add_argument("--modified", type=float, default=0.1, help="share of the release hooks that get modified")
+    parser.add_argument("--scale", type=float, nargs="+", default=[1.0], help="run again with every size multiplied by each factor")
+    parser.add_argument("--release", help="release the synthetic apworld is based on, defaults to the newest in --checksums")
+    parser.add_argument("--checksums", default=os.path.join(REPO_DIRECTORY, "checksums"))
+    parser.add_argument("--template", help="the release's .apworld, so uploads match their base version instead of only coming close")
+    parser.add_argument("--schemas", help="directory of Manual.<table>.schema.json files to serve, defaults to generated ones")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=0, help="analysis_workers for the check_apworld stages, 0 runs in process")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4], help="parallel uploads for the throughput stage")
+    parser.add_argument("--workdir", help="where config.json, cache/ and the apworlds go, defaults to a temporary directory")
+    parser.add_argument("--output", help="write the results here instead of stdout")
+    return parser.parse_args(argv)
+
+
+async def measure(name: str, func: Callable[[], Any | Awaitable[Any]], repeat: int, setup: Callable[[], None] | None = None) -> dict[str, Any]:
+    # Timed runs first, then one more under tracemalloc for the peak, which would otherwise skew the timings
+    async def call() -> Any:
+        result = func()
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        await call()
+        timings.append(time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        await call()
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        "stage": name,
+        "runs": repeat,
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "mean_s": statistics.fmean(timings),
+        "max_s": max(timings),
+        "peak_bytes": peak,
+    }
+    print(f"  {name:<28} median {result['median_s'] * 1000:9.2f} ms   peak {peak / 1024:9.1f} KiB", file=sys.stderr)
+    return result
+
+
+async def serve_schemas(directory: str):
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_static("/", directory)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/"
+
+
+def latest_release(checksums_directory: str) -> str:
+    from manual_checker.version_index import numeric_version
+
+    versions = [os.path.splitext(os.path.basename(path))[0] for path in glob.glob(os.path.join(checksums_directory, "*.hooks"))]
+    if not versions:
+        raise SystemExit(f"No releases found in {checksums_directory}")
+    return max(versions, key=numeric_version)
+
+
+def make_checker(workers: int, results_directory: str):
+    from manual_checker import analysis
+    from manual_checker.pipeline import Checker
+    from manual_checker.report_store import ReportStore
+    from manual_checker.result_cache import ResultCache
+
+    return Checker(analysis.AnalysisEngine(workers=workers), ResultCache(results_directory), ReportStore(256 * 1024 * 1024, 24 * 60 * 60))
+
+
+async def run_size(args: argparse.Namespace, scale: float, schema_base_url: str) -> dict[str, Any]:
+    from manual_checker import analysis, schema_validate
+    from manual_checker.validate_logic import validate_regions
+    from manual_checker.report import Report
+
+    sizes = {
+        "items": int(args.items * scale),
+        "locations": int(args.locations * scale),
+        "regions": max(1, int(args.regions * scale)),
+        "hooks": int(args.hooks * scale),
+    }
+    print(f"{sizes} based on {args.release}", file=sys.stderr)
+    release_checksums, release_hooks = synthetic.load_release(args.checksums, args.release)
+    path = os.path.join("apworlds", f"manual_benchmark_{scale:g}.apworld")
+    synthetic.build_apworld(path, release_checksums, release_hooks, modified=args.modified, template=args.template, **sizes)
+
+    results_directory = os.path.join("cache", f"bench_results_{scale:g}")
+    checker = make_checker(args.workers, results_directory)
+    checker.load_known_versions(args.checksums)
+
+    stages = []
+    report, jsons = analysis.parse_apworld(path, 0)
+    stages.append(await measure("parse_apworld", lambda: analysis.parse_apworld(path, 0), args.repeat))
+
+    asts = {}
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            fn = "/".join(info.filename.split("/")[1:])
+            if fn.startswith("hooks/") and fn.endswith(".py"):
+                asts[fn] = ast.parse(zf.read(info))
+    stages.append(await measure("hash_functions", lambda: analysis.hash_functions({}, {}, asts), args.repeat))
+
+    # The release's own checksums take the exact match path, the synthetic upload the closest match one
+    def identify(checksums: dict[str, int]) -> None:
+        checker.identify_base_version(checksums, Report(0, path, report.name, None, {}, hook_checksums=report.hook_checksums))
+
+    stages.append(await measure("identify_base_version", lambda: identify(release_checksums), args.repeat))
+    stages.append(await measure("identify_base_version_miss", lambda: identify(report.checksums), args.repeat))
+
+    schema_validate.SCHEMA_BASE_URL = schema_base_url
+    tables = {os.path.splitext(os.path.basename(fn))[0]: data for fn, data in jsons.items() if data is not None}
+
+    def forget_schemas() -> None:
+        for state in (schema_validate.SCHEMAS, schema_validate.SCHEMA_DIGESTS, schema_validate.SCHEMA_META, schema_validate.VALIDATORS):
+            state.clear()
+        shutil.rmtree(schema_validate.CACHE_DIRECTORY, ignore_errors=True)
+
+    async def validate_all() -> None:
+        for table, data in tables.items():
+            await schema_validate.validate_json(table, data)
+
+    stages.append(await measure("validate_json_cold", validate_all, args.repeat, setup=forget_schemas))
+    stages.append(await measure("validate_json_warm", validate_all, args.repeat))
+    for table, data in tables.items():
+        stages.append(await measure(f"validate_json[{table}]", lambda table=table, data=data: schema_validate.validate_json(table, data), args.repeat))
+    stages.append(await measure("validate_regions", lambda: validate_regions(tables["regions"], Report(0, path, report.name, None, {})), args.repeat))
+
+    def forget_results() -> None:
+        shutil.rmtree(results_directory, ignore_errors=True)
+
+    stages.append(await measure("check_apworld_cold", lambda: checker.check_apworld(path), args.repeat, setup=forget_results))
+    stages.append(await measure("check_apworld_cached", lambda: checker.check_apworld(path), args.repeat))
+
+    throughput = []
+    for concurrency in args.concurrency:
+        # Different seeds, so the result cache can't answer for them
+        copies = [
+            synthetic.build_apworld(
+                os.path.join("apworlds", f"manual_benchmark_{scale:g}_{i}.apworld"),
+                release_checksums,
+                release_hooks,
+                modified=args.modified,
+                seed=i,
+                template=args.template,
+                **sizes,
+            )
+            for i in range(concurrency)
+        ]
+        forget_results()
+        start = time.perf_counter()
+        reports = await asyncio.gather(*(checker.check_apworld(copy) for copy in copies))
+        elapsed = time.perf_counter() - start
+        throughput.append({"concurrency": concurrency, "workers": args.workers, "wall_s": elapsed, "apworlds_per_s": concurrency / elapsed})
+        print(f"  {concurrency} concurrent uploads         {elapsed * 1000:9.2f} ms", file=sys.stderr)
+    checker.engine.shutdown()
+
+    final = reports[-1] if throughput else await checker.check_apworld(path)
+    report_json = json.dumps(final.to_dict(), separators=(",", ":")).encode()
+    return {
+        "scale": scale,
+        "sizes": sizes,
+        "apworld_bytes": os.path.getsize(path),
+        "report_bytes": len(report_json),
+        "report_compressed_bytes": len(zlib.compress(report_json)),
+        "modified_hook_functions": len(final.modified_hook_functions),
+        "stages": stages,
+        "throughput": throughput,
+    }
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    schema_directory = args.schemas
+    if schema_directory is None:
+        schema_directory = os.path.join("cache", "bench_schemas")
+        synthetic.write_schemas(schema_directory)
+    runner, schema_base_url = await serve_schemas(os.path.abspath(schema_directory))
+    try:
+        results = [await run_size(args, scale, schema_base_url) for scale in args.scale]
+    finally:
+        from shared import http_client
+
+        await http_client.client.close()
+        await runner.cleanup()
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "release": args.release,
+        "repeat": args.repeat,
+        "results": results,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    args.checksums = os.path.abspath(args.checksums)
+    output = os.path.abspath(args.output) if args.output else None
+    for option in ("schemas", "template"):
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+    workdir = args.workdir or tempfile.mkdtemp(prefix="manual_checker_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    # config.json, cache/ and apworlds/ are all relative to the working directory, keep them away from the bot's
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIRECTORY)
+
+    # The checker reports its progress with print, which would end up in the middle of the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        args.release = args.release or latest_release(args.checksums)
+        results = asyncio.run(run(args))
+    text = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
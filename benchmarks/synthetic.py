@@ -0,0 +1,199 @@
+import base64
+import json
+import os
+import random
+import zipfile
+from collections import defaultdict
+
+# Loosely follows the shape of the Manual schemas, enough for validation to do representative work when the real
+# schema files aren't around.
+SCHEMAS = {
+    "game": {
+        "$schema": "http://json-schema.org/draft-07/schema#",
+        "type": "object",
+        "required": ["game", "creator", "filler_item_name"],
+        "properties": {
+            "$schema": {"type": "string"},
+            "game": {"type": "string", "pattern": "^[^_]+$"},
+            "creator": {"type": "string"},
+            "filler_item_name": {"type": "string"},
+            "starting_items": {"type": "array", "items": {"type": "object"}},
+        },
+    },
+    "items": {
+        "$schema": "http://json-schema.org/draft-07/schema#",
+        "type": "array",
+        "items": {
+            "type": "object",
+            "required": ["name"],
+            "additionalProperties": False,
+            "properties": {
+                "name": {"type": "string", "minLength": 1},
+                "count": {"type": "integer", "minimum": 0},
+                "category": {"type": "array", "items": {"type": "string"}, "uniqueItems": True},
+                "value": {"type": "object", "additionalProperties": {"type": "integer"}},
+                "progression": {"type": "boolean"},
+                "useful": {"type": "boolean"},
+                "trap": {"type": "boolean"},
+                "filler": {"type": "boolean"},
+            },
+        },
+    },
+    "locations": {
+        "$schema": "http://json-schema.org/draft-07/schema#",
+        "type": "array",
+        "items": {
+            "type": "object",
+            "required": ["name"],
+            "additionalProperties": False,
+            "properties": {
+                "name": {"type": "string", "minLength": 1},
+                "region": {"type": "string"},
+                "category": {"type": "array", "items": {"type": "string"}, "uniqueItems": True},
+                "requires": {"oneOf": [{"type": "string"}, {"type": "array"}]},
+                "victory": {"type": "boolean"},
+                "prehint": {"type": "boolean"},
+            },
+        },
+    },
+    "regions": {
+        "$schema": "http://json-schema.org/draft-07/schema#",
+        "type": "object",
+        "additionalProperties": {
+            "type": "object",
+            "additionalProperties": False,
+            "properties": {
+                "requires": {"oneOf": [{"type": "string"}, {"type": "array"}]},
+                "connects_to": {"type": "array", "items": {"type": "string"}},
+                "starting": {"type": "boolean"},
+                "exit_requires": {"type": "object", "additionalProperties": {"type": "string"}},
+                "entrance_requires": {"type": "object", "additionalProperties": {"type": "string"}},
+            },
+        },
+    },
+    "categories": {
+        "$schema": "http://json-schema.org/draft-07/schema#",
+        "type": "object",
+        "additionalProperties": {
+            "type": "object",
+            "properties": {"hidden": {"type": "boolean"}, "yaml_option": {"type": "array", "items": {"type": "string"}}},
+        },
+    },
+}
+
+
+def write_schemas(directory: str) -> None:
+    os.makedirs(directory, exist_ok=True)
+    for table, schema in SCHEMAS.items():
+        with open(os.path.join(directory, f"Manual.{table}.schema.json"), "w") as f:
+            json.dump(schema, f)
+
+
+def load_release(checksums_directory: str, version: str) -> tuple[dict[str, int], dict[str, str]]:
+    with open(os.path.join(checksums_directory, f"{version}.checksums")) as f:
+        checksums = json.load(f)
+    with open(os.path.join(checksums_directory, f"{version}.hooks")) as f:
+        hooks = json.load(f)
+    return checksums, hooks
+
+
+def build_tables(items: int, locations: int, regions: int, seed: int = 0) -> dict[str, object]:
+    rng = random.Random(seed)
+    categories = [f"Category {i}" for i in range(max(1, items // 50))]
+    item_names = [f"Item {i}" for i in range(items)]
+    region_names = [f"Region {i}" for i in range(regions)]
+
+    region_table: dict[str, dict] = {}
+    for i, name in enumerate(region_names):
+        # A chain so every region is reachable, plus a few random shortcuts
+        connects = [region_names[i + 1]] if i + 1 < regions else []
+        connects += rng.sample(region_names, min(2, regions))
+        region_table[name] = {"connects_to": sorted(set(connects) - {name}), "requires": f"|{rng.choice(item_names)}|" if item_names and i else ""}
+    if region_names:
+        region_table[region_names[0]]["starting"] = True
+
+    return {
+        "game": {"game": "Benchmark", "creator": "Synthetic", "filler_item_name": "Nothing"},
+        "items": [
+            {"name": name, "count": rng.randint(1, 3), "category": rng.sample(categories, 1), "progression": rng.random() < 0.3}
+            for name in item_names
+        ],
+        "locations": [
+            {
+                "name": f"Location {i}",
+                "region": rng.choice(region_names) if region_names else None,
+                "category": rng.sample(categories, 1),
+                "requires": " and ".join(f"|{item}|" for item in rng.sample(item_names, min(2, items))),
+            }
+            for i in range(locations)
+        ],
+        "regions": region_table,
+        "categories": {category: {"hidden": False} for category in categories},
+    }
+
+
+def build_hooks(release_hooks: dict[str, str], extra_hooks: int, modified: float, seed: int = 0) -> dict[str, str]:
+    # Returns module name -> source.  The release hooks are reassembled into their modules, a share of them gets an
+    # extra statement so they show up as modified, and synthetic rule functions are appended to Rules.
+    rng = random.Random(seed)
+    modules: defaultdict[str, list[str]] = defaultdict(list)
+    for name, encoded in release_hooks.items():
+        module, function = name.split(".", 1)
+        if "." in function:
+            # Methods were stored with their class, which is already part of another entry
+            continue
+        source = base64.b64decode(encoded.encode()).decode()
+        if source.startswith(("def ", "async def ")) and rng.random() < modified:
+            header, _, body = source.partition("\n")
+            source = f"{header}\n    benchmark_marker = {rng.randint(0, 1 << 30)}\n{body}"
+        modules[module].append(source)
+    for i in range(extra_hooks):
+        modules["Rules"].append(
+            f"def synthetic_rule_{i}(world, multiworld, state, player):\n"
+            f"    count = 0\n"
+            f"    for item in ('Item {i}', 'Item {i + 1}'):\n"
+            f"        if state.has(item, player):\n"
+            f"            count += 1\n"
+            f"    return count >= {1 + i % 2}\n"
+        )
+    return {module: "\n\n".join(sources) + "\n" for module, sources in modules.items()}
+
+
+def build_apworld(
+    path: str,
+    release_checksums: dict[str, int],
+    release_hooks: dict[str, str],
+    items: int,
+    locations: int,
+    regions: int,
+    hooks: int,
+    modified: float = 0.1,
+    seed: int = 0,
+    template: str | None = None,
+) -> str:
+    folder = os.path.splitext(os.path.basename(path))[0]
+    tables = build_tables(items, locations, regions, seed)
+    hook_modules = build_hooks(release_hooks, hooks, modified, seed)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        # Same file layout as the release.  Everything that isn't generated is copied from the release apworld when
+        # there is one, which lets the upload match its base version, otherwise it is a placeholder.
+        if template:
+            with zipfile.ZipFile(template) as source:
+                for info in source.infolist():
+                    fn = "/".join(info.filename.split("/")[1:])
+                    if fn and not info.is_dir() and not fn.startswith(("data/", "hooks/")) and "__pycache__" not in fn:
+                        zf.writestr(f"{folder}/{fn}", source.read(info))
+        else:
+            for fn in release_checksums:
+                if fn.startswith(("data/", "hooks/")) or "." not in os.path.basename(fn):
+                    continue
+                zf.writestr(f"{folder}/{fn}", "# placeholder\n" if fn.endswith(".py") else "")
+        if not template and "__init__.py" not in release_checksums:
+            zf.writestr(f"{folder}/__init__.py", "# placeholder\n")
+        for table, data in tables.items():
+            zf.writestr(f"{folder}/data/{table}.json", json.dumps(data, indent=2))
+        zf.writestr(f"{folder}/hooks/__init__.py", "")
+        for module, source in hook_modules.items():
+            zf.writestr(f"{folder}/hooks/{module}.py", source)
+    return path
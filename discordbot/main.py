@@ -3,7 +3,7 @@ import sys
 
 import interactions
 
-from shared import configuration
+from shared import configuration, metrics, startup
 
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
@@ -31,6 +31,12 @@ class Bot(interactions.Client):
     def init(self) -> None:
         self.start(configuration.get("token"))
 
+    @interactions.listen()
+    async def on_startup(self, event: interactions.events.Startup) -> None:
+        await metrics.start()
+        # Extensions registered their warm-up work when they were loaded, none of it holds up the gateway
+        startup.start()
+
     async def on_ready(self) -> None:
         print(
             "Logged in as {username} ({id})".format(
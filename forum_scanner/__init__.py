@@ -1,128 +1,241 @@
 import asyncio
-from collections import defaultdict
-import json
+import hashlib
+import io
 import logging
 import os
-import re
 from interactions import events
-from interactions.models import Extension, listen, GuildCategory, GuildForum, GuildForumPost, User
+from interactions.client.errors import NotFound
+from interactions.models import BaseChannel, Extension, listen, GuildCategory, GuildForum, GuildForumPost, Message, User
 from interactions.models.internal import tasks
 import sentry_sdk
 
-MANUALS = {}
+from shared import configuration, metrics, startup
+
+from .catalog import Catalog
+from .links import release_url, resolve_latest
+
+MANUAL_CATEGORY = 1097565035066298378
+
 
 class Scanner(Extension):
+    catalog = Catalog()
+
+    def __init__(self, bot) -> None:
+        # Rate limited and slow, so it goes after the checker's warm-up instead of competing with it
+        startup.add("forum_scan", self.warm_up, priority=2)
+
+    def drop(self) -> None:
+        self.catalog.close()
+        super().drop()
+
     @listen()
-    async def on_ready(self, event: events.Ready) -> None:
-        if os.path.exists("manuals.json"):
-            with open("manuals.json") as f:
-                MANUALS.update(json.load(f))
-        await self.iterate_threads()
+    async def on_startup(self, event: events.Startup) -> None:
+        self.daily_tasks.start()
+
+    async def warm_up(self) -> None:
+        self.catalog.migrate_json()
+        await self.iterate_threads(full=configuration.get("scanner_full_rescan", False))
         # await self.build_index()
 
     @tasks.Task.create(tasks.CronTrigger("0 0 * * *"))
     async def daily_tasks(self) -> None:
         await self.iterate_threads()
+        if configuration.get("build_index", False):
+            await self.build_index()
 
-    async def iterate_threads(self) -> None:
-        category: GuildCategory = self.bot.get_channel(1097565035066298378)
+    async def iterate_threads(self, full: bool = False) -> None:
+        category: GuildCategory = self.bot.get_channel(MANUAL_CATEGORY)
         if category is None:
             return
         for forum in category.channels:
             if isinstance(forum, GuildForum):
-                await self.scan_forum(forum)
-        with open("manuals.json", "w") as f:
-            json.dump(MANUALS, f, indent=2)
+                await self.scan_forum(forum, full)
+
+    async def scan_forum(self, forum: GuildForum, full: bool = False) -> None:
+        with metrics.span("forum_scanner.scan_forum", forum=forum.name, full=full):
+            await self._scan_forum(forum, full)
 
-    async def scan_forum(self, forum: GuildForum) -> None:
-        MANUALS.setdefault(forum.name, defaultdict(dict))
+    async def _scan_forum(self, forum: GuildForum, full: bool = False) -> None:
         for thread in await forum.fetch_posts():
-            await self.scan_thread(forum, thread)
+            if await self.scan_thread(forum, thread, full):
+                await asyncio.sleep(10)
+        # Archived posts come newest archive first, so once we pass the newest archive seen by the last completed
+        # scan everything after it is unchanged too.  The watermark only moves once the pass finishes, so an
+        # interrupted pass is walked again rather than skipped.
+        watermark = None if full else self.catalog.archive_watermark(forum.name)
+        newest = watermark
         older = forum.archived_posts()
         async for thread in older:
-            await self.scan_thread(forum, thread)
+            archive_timestamp = thread.archive_timestamp.timestamp() if thread.archive_timestamp else None
+            if watermark is not None and archive_timestamp is not None and archive_timestamp <= watermark and self.catalog.thread(str(thread.id)):
+                break
+            if archive_timestamp is not None and (newest is None or archive_timestamp > newest):
+                newest = archive_timestamp
+            if await self.scan_thread(forum, thread, full):
+                await asyncio.sleep(10)
+        self.catalog.set_archive_watermark(forum.name, newest)
 
-    async def scan_thread(self, forum: GuildForum, thread: GuildForumPost) -> None:
+    async def scan_thread(self, forum: GuildForum, thread: GuildForumPost, full: bool = False) -> bool:
+        # Returns whether any requests were made, so bulk scans only pace themselves when they need to
+        with metrics.span("forum_scanner.scan_thread"):
+            fetched = await self._scan_thread(forum, thread, full)
+        metrics.count("threads_scanned_total", fetched=fetched)
+        return fetched
+
+    async def _scan_thread(self, forum: GuildForum, thread: GuildForumPost, full: bool = False) -> bool:
         thread_id = str(thread.id)
-        MANUALS[forum.name].setdefault(thread_id, {}).update({
-                "title": thread.name,
-                "author": thread.owner_id,
-            })
-        if thread.applied_tags:
-            MANUALS[forum.name][thread_id]["tags"] = [tag.name for tag in thread.applied_tags]
-        if not thread.archived:
+        self.catalog.upsert_thread(
+            forum.name,
+            thread_id,
+            thread.name,
+            thread.owner_id,
+            thread.archived,
+            thread.archive_timestamp.timestamp() if thread.archive_timestamp else None,
+            str(thread.last_message_id) if thread.last_message_id else None,
+            [tag.name for tag in thread.applied_tags] if thread.applied_tags else None,
+        )
+        if thread.archived:
             # A bunch of stuff not worth doing for threads that havn't been touched in a while
-            if not MANUALS[forum.name].setdefault(thread_id, {}).get("_joined_thread", False):
-                MANUALS[forum.name][thread_id]["_joined_thread"] = True
-                logging.info(f"Joining {thread.name}")
-                await thread.join()
-            try:
-                pins = await thread.fetch_pinned_messages()
-            except AttributeError as e:
-                sentry_sdk.capture_exception(e)
-                pins = []
-                await asyncio.sleep(60)
-
-            for pin in pins:
-                if pin._guild_id is None:
-                    pin._guild_id = forum._guild_id
-                MANUALS[forum.name][thread_id].setdefault("pins", {})[str(pin.id)] = {
-                    "author": pin._author_id,
-                    "content": pin.content,
-                    "attachments": [attachment.filename for attachment in pin.attachments],
-                    "url": pin.proto_url,
-                }
-            await asyncio.sleep(10)
+            return False
+
+        entry = self.catalog.thread(thread_id)
+        fetched = False
+        if not entry["joined"]:
+            self.catalog.mark_joined(thread_id)
+            logging.info(f"Joining {thread.name}")
+            await thread.join()
+            fetched = True
+        pin_timestamp = thread.last_pin_timestamp.timestamp() if thread.last_pin_timestamp else None
+        if not full and not entry["pins_dirty"] and entry["pins_scanned"] and entry["last_pin_timestamp"] == pin_timestamp:
+            metrics.cache("pins", True)
+            return fetched
+        metrics.cache("pins", False)
+
+        try:
+            pins = await thread.fetch_pinned_messages()
+        except AttributeError as e:
+            sentry_sdk.capture_exception(e)
+            await asyncio.sleep(60)
+            return True
+
+        for pin in pins:
+            if pin._guild_id is None:
+                pin._guild_id = forum._guild_id
+        self.catalog.set_pins(thread_id, {str(pin.id): pin_data(pin) for pin in pins}, pin_timestamp)
+        return True
+
+    def tracked_forum(self, thread: BaseChannel) -> GuildForum | None:
+        if not isinstance(thread, GuildForumPost):
+            return None
+        forum = thread.parent_channel
+        if not isinstance(forum, GuildForum) or forum.parent_id != MANUAL_CATEGORY:
+            return None
+        return forum
+
+    @listen()
+    async def on_thread_create(self, event: events.ThreadCreate) -> None:
+        if forum := self.tracked_forum(event.thread):
+            await self.scan_thread(forum, event.thread)
+
+    @listen()
+    async def on_thread_update(self, event: events.ThreadUpdate) -> None:
+        # Covers renames, tag changes and (un)archiving
+        if forum := self.tracked_forum(event.thread):
+            await self.scan_thread(forum, event.thread)
+
+    @listen()
+    async def on_channel_pins_update(self, event: events.ChannelPinsUpdate) -> None:
+        if forum := self.tracked_forum(event.channel):
+            self.catalog.mark_pins_dirty(str(event.channel.id))
+            await self.scan_thread(forum, event.channel)
+
+    @listen()
+    async def on_message_update(self, event: events.MessageUpdate) -> None:
+        # Editing a pinned message doesn't touch the pin timestamp, so keep the stored copy current here
+        if not event.after or not event.after.pinned:
+            return
+        if self.tracked_forum(event.after.channel) and self.catalog.thread(str(event.after._channel_id)):
+            self.catalog.store_pin(str(event.after._channel_id), str(event.after.id), pin_data(event.after))
 
     async def build_index(self) -> None:
-        await self.write_page("board_games", "Board & Card Games", MANUALS["board-card-games"])
-        await self.write_page("meta-games", "Meta Games", MANUALS["meta-games"])
-        await self.write_page("video-games", "Video Games", MANUALS["video-games"])
-        pass
-
-    async def write_page(self, filename: str, title: str, data: dict) -> None:
-        async def lookup_user(user_id: int) -> str:
-            user: User = await self.bot.fetch_user(user_id)
-            return user.display_name
-
-        with open(f"docs/{filename}.md", "w", encoding='utf-8') as f:
-            f.write('---\n')
-            f.write('layout: default\n')
-            f.write(f"title: {title}\n")
-            f.write(f'permalink: /{filename}/\n')
-            f.write('---\n')
-            for thread_id, thread in data.items():
-                if "Ready to Use" not in thread.get("tags", []):
-                    continue
-                url = f"discord://-/channels/1097532591650910289/{thread_id}"
-                f.write(f'## [{thread["title"]}]({url})\n')
-                f.write(f'by {await lookup_user(thread["author"])}\n')
-                if "tags" in thread:
-                    f.write(f'\nTags: {", ".join(thread["tags"])}\n')
-                f.write('\n')
-                if "pins" in thread:
-                    for _pin_id, pin in thread["pins"].items():
-                        data = self.interpret_pin(pin)
-                        if "github_url" in data:
-                            f.write(f'#### [{data["github_url"]}]({data["github_url"]})\n')
-                        elif "attached_apworld" in data:
-                            f.write(f'#### [{data["attached_apworld"]}]({pin["url"]})\n')
-
-                f.write('\n')
-        pass
-
-    def interpret_pin(self, pin: dict) -> dict:
-        ret = {}
-        for attachment in pin["attachments"]:
-            if attachment.endswith(".apworld"):
-                ret["attached_apworld"] = attachment
-        release = re.match(r"https://github.com/([\w_\-]+)/([\w_\-]+)/releases(/latest|/tag/([\w_\.\-]+))?", pin["content"])
-        if release:
-            ret["github_username"] = release.group(1)
-            ret["github_repo"] = release.group(2)
-            if release.group(4):
-                ret["tag"] = release.group(4)
-                ret["github_url"] = f"https://github.com/{ret['github_username']}/{ret['github_repo']}/releases/tag/{ret['tag']}"
-            else:
-                ret["github_url"] = f"https://github.com/{ret['github_username']}/{ret['github_repo']}/releases"
-        return ret
+        with metrics.span("forum_scanner.build_index"):
+            await self._build_index()
+
+    async def _build_index(self) -> None:
+        os.makedirs("docs", exist_ok=True)
+        await self.write_page("board_games", "Board & Card Games", self.catalog.ready_threads("board-card-games"))
+        await self.write_page("meta-games", "Meta Games", self.catalog.ready_threads("meta-games"))
+        await self.write_page("video-games", "Video Games", self.catalog.ready_threads("video-games"))
+
+    async def resolve_users(self, user_ids: set[int]) -> dict[int, str]:
+        names, stale = self.catalog.user_names(user_ids, configuration.get("user_name_ttl", 7 * 24 * 60 * 60))
+        metrics.count("cache_requests_total", len(user_ids) - len(stale), cache="user_names", result="hit")
+        metrics.count("cache_requests_total", len(stale), cache="user_names", result="miss")
+        limit = asyncio.Semaphore(configuration.get("user_lookup_concurrency", 5))
+
+        async def lookup_user(user_id: int) -> tuple[int, str | None]:
+            async with limit:
+                try:
+                    user: User = await self.bot.fetch_user(user_id)
+                except NotFound:
+                    user = None
+            return user_id, user.display_name if user else None
+
+        fetched = {user_id: name for user_id, name in await asyncio.gather(*(lookup_user(user_id) for user_id in stale)) if name}
+        self.catalog.store_user_names(fetched)
+        names.update(fetched)
+        return names
+
+    async def write_page(self, filename: str, title: str, threads: list[dict]) -> bool:
+        # Only rewrites the page when its rendered content changed.  Author names come from the catalog and only
+        # missing or expired ones cost a request, each looked up once however many manuals they own.
+        names = await self.resolve_users({thread["author"] for thread in threads if thread["author"]})
+
+        f = io.StringIO()
+        f.write('---\n')
+        f.write('layout: default\n')
+        f.write(f"title: {title}\n")
+        f.write(f'permalink: /{filename}/\n')
+        f.write('---\n')
+        for thread in threads:
+            url = f"discord://-/channels/1097532591650910289/{thread['id']}"
+            f.write(f'## [{thread["title"]}]({url})\n')
+            f.write(f'by {names.get(thread["author"], thread["author"])}\n')
+            if thread["tags"]:
+                f.write(f'\nTags: {", ".join(thread["tags"])}\n')
+            f.write('\n')
+            if thread["pins"]:
+                for _pin_id, pin in thread["pins"].items():
+                    if pin["kind"] == "github_release":
+                        tag = pin["tag"]
+                        if pin["latest"] and configuration.get("resolve_latest_releases", False):
+                            tag = await resolve_latest(self.catalog, pin["owner"], pin["repo"], configuration.get("latest_release_ttl", 24 * 60 * 60))
+                        github_url = release_url(pin["owner"], pin["repo"], tag)
+                        f.write(f'#### [{github_url}]({github_url})\n')
+                    elif pin["kind"] == "attachment":
+                        f.write(f'#### [{pin["apworld"]}]({pin["url"]})\n')
+                    elif pin["kind"] == "link":
+                        f.write(f'#### [{pin["apworld"]}]({pin["link"]})\n')
+
+            f.write('\n')
+
+        content = f.getvalue()
+        path = f"docs/{filename}.md"
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        if os.path.exists(path) and self.catalog.page_digest(filename) == digest:
+            return False
+        with open(path + ".tmp", "w", encoding='utf-8') as out:
+            out.write(content)
+        os.replace(path + ".tmp", path)
+        self.catalog.set_page_digest(filename, digest)
+        logging.info(f"Regenerated {path}")
+        return True
+
+
+def pin_data(pin: Message) -> dict:
+    return {
+        "author": pin._author_id,
+        "content": pin.content,
+        "attachments": [attachment.filename for attachment in pin.attachments],
+        "url": pin.proto_url,
+    }
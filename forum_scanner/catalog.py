@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Iterable
+
+from .links import PIN_FIELDS, classify_pin
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS forums (
+    name TEXT PRIMARY KEY,
+    archive_watermark REAL
+);
+CREATE TABLE IF NOT EXISTS threads (
+    id TEXT PRIMARY KEY,
+    forum TEXT NOT NULL REFERENCES forums(name),
+    title TEXT NOT NULL,
+    author INTEGER,
+    archived INTEGER NOT NULL DEFAULT 0,
+    archive_timestamp REAL,
+    last_message_id TEXT,
+    last_pin_timestamp REAL,
+    pins_scanned INTEGER NOT NULL DEFAULT 0,
+    pins_dirty INTEGER NOT NULL DEFAULT 0,
+    joined INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS threads_forum ON threads(forum);
+CREATE INDEX IF NOT EXISTS threads_author ON threads(author);
+CREATE TABLE IF NOT EXISTS tags (
+    thread_id TEXT NOT NULL REFERENCES threads(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    PRIMARY KEY (thread_id, name)
+);
+CREATE INDEX IF NOT EXISTS tags_name ON tags(name, thread_id);
+CREATE TABLE IF NOT EXISTS pins (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT NOT NULL REFERENCES threads(id) ON DELETE CASCADE,
+    author INTEGER,
+    content TEXT,
+    attachments TEXT NOT NULL DEFAULT '[]',
+    url TEXT,
+    kind TEXT,
+    owner TEXT,
+    repo TEXT,
+    tag TEXT,
+    apworld TEXT,
+    link TEXT,
+    latest INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS pins_thread ON pins(thread_id);
+CREATE INDEX IF NOT EXISTS pins_repo ON pins(owner, repo);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    display_name TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    filename TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS github_latest (
+    owner TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    tag TEXT,
+    etag TEXT,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (owner, repo)
+);
+"""
+SCHEMA_VERSION = 2
+
+
+class Catalog:
+    # Every thread is written as soon as it is scanned, so an interrupted scan picks up where it stopped instead of
+    # losing everything like the old end-of-scan manuals.json dump did.
+    def __init__(self, path: str = "manuals.db") -> None:
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA foreign_keys=ON")
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version < 2 and self._db.execute("SELECT 1 FROM sqlite_master WHERE name = 'pins'").fetchone():
+                self._classify_existing_pins()
+            self._db.executescript(SCHEMA)
+            self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return self._db
+
+    def _classify_existing_pins(self) -> None:
+        # Version 1 catalogs predate the link columns on pins
+        with self._db:
+            columns = {row["name"] for row in self._db.execute("PRAGMA table_info(pins)")}
+            for column in PIN_FIELDS:
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE pins ADD COLUMN {column} {'INTEGER NOT NULL DEFAULT 0' if column == 'latest' else 'TEXT'}")
+            for row in self._db.execute("SELECT id, content, attachments FROM pins").fetchall():
+                fields = classify_pin(row["content"], json.loads(row["attachments"]))
+                self._db.execute(f"UPDATE pins SET {', '.join(f'{column} = ?' for column in PIN_FIELDS)} WHERE id = ?", (*(fields[column] for column in PIN_FIELDS), row["id"]))
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def migrate_json(self, path: str = "manuals.json") -> None:
+        if not os.path.exists(path) or self.db.execute("SELECT 1 FROM threads LIMIT 1").fetchone():
+            return
+        with open(path) as f:
+            manuals = json.load(f)
+        with self.db:
+            for forum, threads in manuals.items():
+                for thread_id, thread in threads.items():
+                    self._upsert_thread(forum, thread_id, thread.get("title", ""), thread.get("author"), thread.get("_archived", False),
+                                        thread.get("_archive_timestamp"), thread.get("_last_message_id"), thread.get("tags", []))
+                    self.db.execute(
+                        "UPDATE threads SET joined = ?, last_pin_timestamp = ?, pins_scanned = ? WHERE id = ?",
+                        (thread.get("_joined_thread", False), thread.get("_last_pin_timestamp"), "_last_pin_timestamp" in thread, thread_id),
+                    )
+                    for pin_id, pin in thread.get("pins", {}).items():
+                        self._store_pin(thread_id, pin_id, pin)
+        os.replace(path, path + ".migrated")
+        logging.info(f"Migrated {path} into {self.path}")
+
+    def thread(self, thread_id: str) -> sqlite3.Row | None:
+        return self.db.execute("SELECT * FROM threads WHERE id = ?", (thread_id,)).fetchone()
+
+    def upsert_thread(
+        self,
+        forum: str,
+        thread_id: str,
+        title: str,
+        author: int,
+        archived: bool,
+        archive_timestamp: float | None,
+        last_message_id: str | None,
+        tags: Iterable[str] | None,
+    ) -> None:
+        with self.db:
+            self._upsert_thread(forum, thread_id, title, author, archived, archive_timestamp, last_message_id, tags)
+
+    def _upsert_thread(self, forum, thread_id, title, author, archived, archive_timestamp, last_message_id, tags) -> None:
+        self.db.execute("INSERT OR IGNORE INTO forums (name) VALUES (?)", (forum,))
+        self.db.execute(
+            """INSERT INTO threads (id, forum, title, author, archived, archive_timestamp, last_message_id) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET forum = excluded.forum, title = excluded.title, author = excluded.author, archived = excluded.archived,
+                archive_timestamp = excluded.archive_timestamp, last_message_id = excluded.last_message_id""",
+            (thread_id, forum, title, author, archived, archive_timestamp, last_message_id),
+        )
+        if tags is not None:
+            self.db.execute("DELETE FROM tags WHERE thread_id = ?", (thread_id,))
+            self.db.executemany("INSERT INTO tags (thread_id, name) VALUES (?, ?)", [(thread_id, tag) for tag in tags])
+
+    def mark_joined(self, thread_id: str) -> None:
+        with self.db:
+            self.db.execute("UPDATE threads SET joined = 1 WHERE id = ?", (thread_id,))
+
+    def mark_pins_dirty(self, thread_id: str) -> None:
+        with self.db:
+            self.db.execute("UPDATE threads SET pins_dirty = 1 WHERE id = ?", (thread_id,))
+
+    def set_pins(self, thread_id: str, pins: dict[str, dict[str, Any]], last_pin_timestamp: float | None) -> None:
+        with self.db:
+            self.db.execute("DELETE FROM pins WHERE thread_id = ?", (thread_id,))
+            for pin_id, pin in pins.items():
+                self._store_pin(thread_id, pin_id, pin)
+            self.db.execute("UPDATE threads SET last_pin_timestamp = ?, pins_scanned = 1, pins_dirty = 0 WHERE id = ?", (last_pin_timestamp, thread_id))
+
+    def store_pin(self, thread_id: str, pin_id: str, pin: dict[str, Any]) -> None:
+        with self.db:
+            self._store_pin(thread_id, pin_id, pin)
+
+    def _store_pin(self, thread_id: str, pin_id: str, pin: dict[str, Any]) -> None:
+        fields = classify_pin(pin["content"], pin["attachments"])
+        self.db.execute(
+            f"INSERT OR REPLACE INTO pins (id, thread_id, author, content, attachments, url, {', '.join(PIN_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?{', ?' * len(PIN_FIELDS)})",
+            (pin_id, thread_id, pin["author"], pin["content"], json.dumps(pin["attachments"]), pin["url"], *(fields[column] for column in PIN_FIELDS)),
+        )
+
+    def archive_watermark(self, forum: str) -> float | None:
+        row = self.db.execute("SELECT archive_watermark FROM forums WHERE name = ?", (forum,)).fetchone()
+        return row["archive_watermark"] if row else None
+
+    def set_archive_watermark(self, forum: str, watermark: float | None) -> None:
+        with self.db:
+            self.db.execute(
+                "INSERT INTO forums (name, archive_watermark) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET archive_watermark = excluded.archive_watermark",
+                (forum, watermark),
+            )
+
+    def user_names(self, user_ids: Iterable[int], ttl: float) -> tuple[dict[int, str], set[int]]:
+        # Returns every cached name, plus the ids that are missing or older than the ttl
+        user_ids = set(user_ids)
+        names = {}
+        fresh = set()
+        cutoff = time.time() - ttl
+        for row in self.db.execute(f"SELECT * FROM users WHERE id IN ({','.join('?' * len(user_ids))})", tuple(user_ids)):
+            names[row["id"]] = row["display_name"]
+            if row["fetched_at"] >= cutoff:
+                fresh.add(row["id"])
+        return names, user_ids - fresh
+
+    def store_user_names(self, names: dict[int, str]) -> None:
+        now = time.time()
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO users (id, display_name, fetched_at) VALUES (?, ?, ?)", [(user_id, name, now) for user_id, name in names.items()])
+
+    def page_digest(self, filename: str) -> str | None:
+        row = self.db.execute("SELECT digest FROM pages WHERE filename = ?", (filename,)).fetchone()
+        return row["digest"] if row else None
+
+    def set_page_digest(self, filename: str, digest: str) -> None:
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO pages (filename, digest) VALUES (?, ?)", (filename, digest))
+
+    def latest_release(self, owner: str, repo: str) -> sqlite3.Row | None:
+        return self.db.execute("SELECT * FROM github_latest WHERE owner = ? AND repo = ?", (owner, repo)).fetchone()
+
+    def store_latest_release(self, owner: str, repo: str, tag: str | None, etag: str | None) -> None:
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO github_latest (owner, repo, tag, etag, fetched_at) VALUES (?, ?, ?, ?, ?)", (owner, repo, tag, etag, time.time()))
+
+    def ready_threads(self, forum: str) -> list[dict[str, Any]]:
+        rows = self.db.execute(
+            "SELECT threads.* FROM tags JOIN threads ON threads.id = tags.thread_id WHERE tags.name = 'Ready to Use' AND threads.forum = ? ORDER BY threads.rowid", (forum,)
+        ).fetchall()
+        return self._with_details(rows)
+
+    def threads_by_author(self, author: int) -> list[dict[str, Any]]:
+        return self._with_details(self.db.execute("SELECT * FROM threads WHERE author = ? ORDER BY rowid", (author,)).fetchall())
+
+    def _with_details(self, rows: list[sqlite3.Row]) -> list[dict[str, Any]]:
+        threads = []
+        for row in rows:
+            thread = dict(row)
+            thread["tags"] = [tag["name"] for tag in self.db.execute("SELECT name FROM tags WHERE thread_id = ? ORDER BY rowid", (row["id"],))]
+            thread["pins"] = {
+                pin["id"]: {**dict(pin), "attachments": json.loads(pin["attachments"]), "latest": bool(pin["latest"])}
+                for pin in self.db.execute("SELECT * FROM pins WHERE thread_id = ? ORDER BY rowid", (row["id"],))
+            }
+            threads.append(thread)
+        return threads
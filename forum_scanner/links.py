@@ -0,0 +1,77 @@
+import re
+import time
+from typing import Any
+
+import aiohttp
+
+from shared import http_client, metrics
+
+GITHUB_RELEASE = re.compile(
+    r"https?://(?:www\.)?github\.com/([\w.\-]+)/([\w.\-]+)/releases(?:/(latest)|/tag/([^\s/?#)>]+)|/download/([^\s/?#)>]+)/([^\s/?#)>]+\.apworld))?",
+    re.IGNORECASE,
+)
+DISCORD_ATTACHMENT = re.compile(r"https?://(?:cdn|media)\.discordapp\.(?:com|net)/attachments/\d+/\d+/([^\s/?#)>]+\.apworld)[^\s)>]*", re.IGNORECASE)
+APWORLD_LINK = re.compile(r"https?://[^\s<>()]+?/([^\s/<>()?#]+\.apworld)\b[^\s)>]*", re.IGNORECASE)
+GITHUB_REPO = re.compile(r"https?://(?:www\.)?github\.com/([\w.\-]+)/([\w.\-]+?)(?:\.git)?(?=[/\s)>#?]|$)", re.IGNORECASE)
+
+PIN_FIELDS = ("kind", "owner", "repo", "tag", "apworld", "link", "latest")
+
+
+def classify_pin(content: str, attachments: list[str]) -> dict[str, Any]:
+    # Worked out once when a pin is stored, in order of how useful the link is to someone looking for the apworld
+    ret: dict[str, Any] = dict.fromkeys(PIN_FIELDS)
+    ret["latest"] = False
+    content = content or ""
+    if release := GITHUB_RELEASE.search(content):
+        owner, repo, latest, tag, download_tag, apworld = release.groups()
+        tag = tag or download_tag
+        ret.update(kind="github_release", owner=owner, repo=repo, tag=tag, apworld=apworld, latest=tag is None)
+        ret["link"] = release_url(owner, repo, tag)
+        return ret
+    for attachment in attachments:
+        if attachment.endswith(".apworld"):
+            ret.update(kind="attachment", apworld=attachment)
+            return ret
+    if link := DISCORD_ATTACHMENT.search(content) or APWORLD_LINK.search(content):
+        ret.update(kind="link", apworld=link.group(1), link=link.group(0))
+        return ret
+    if repo := GITHUB_REPO.search(content):
+        ret.update(kind="github_repo", owner=repo.group(1), repo=repo.group(2), link=f"https://github.com/{repo.group(1)}/{repo.group(2)}")
+    return ret
+
+
+def release_url(owner: str, repo: str, tag: str | None) -> str:
+    if tag:
+        return f"https://github.com/{owner}/{repo}/releases/tag/{tag}"
+    return f"https://github.com/{owner}/{repo}/releases"
+
+
+async def resolve_latest(catalog, owner: str, repo: str, ttl: float) -> str | None:
+    # /releases/latest only changes when the author publishes, so the answer is cached and revalidated with
+    # If-None-Match, which GitHub doesn't count against the rate limit when nothing changed.
+    cached = catalog.latest_release(owner, repo)
+    fresh = cached is not None and time.time() - cached["fetched_at"] < ttl
+    metrics.cache("github_latest", fresh)
+    if fresh:
+        return cached["tag"]
+    headers = {"Accept": "application/vnd.github+json"}
+    if cached and cached["etag"]:
+        headers["If-None-Match"] = cached["etag"]
+    try:
+        async with http_client.client.get(f"https://api.github.com/repos/{owner}/{repo}/releases/latest", headers) as response:
+            if response.status == 304:
+                tag = cached["tag"]
+                etag = cached["etag"]
+            elif response.status == 200:
+                tag = (await response.json()).get("tag_name")
+                etag = response.headers.get("ETag")
+            elif response.status == 404:
+                # No releases (or the repo is gone), worth remembering too
+                tag = None
+                etag = None
+            else:
+                return cached["tag"] if cached else None
+    except aiohttp.ClientError:
+        return cached["tag"] if cached else None
+    catalog.store_latest_release(owner, repo, tag, etag)
+    return tag
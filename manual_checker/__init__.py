@@ -1,7 +1,9 @@
 import os
 
-from .extension import ManualChecker
 
-__all__ = ["ManualChecker"]
+def setup(bot) -> None:
+    # The extension is only imported when the bot loads it, the pipeline and analysis modules don't need Discord
+    from .extension import ManualChecker
 
-os.makedirs("apworlds", exist_ok=True)
+    os.makedirs("apworlds", exist_ok=True)
+    ManualChecker(bot)
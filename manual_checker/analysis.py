@@ -0,0 +1,213 @@
+import ast
+import asyncio
+import base64
+import json
+import os
+import pathlib
+import zipfile
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from shared import configuration
+
+from .fingerprint import fingerprint_source, hook_definitions
+from .report import Report
+from .requires import validate_requires
+from .schema_validate import validate_table
+from .validate_logic import validate_regions
+
+# Part of the result cache generation, bump it whenever a check is added or changes what it reports
+ANALYSIS_VERSION = 2
+
+
+class AnalysisEngine:
+    def __init__(self, workers: int | None = None, timeout: float | None = None) -> None:
+        # 0 workers runs the stages on the default thread pool instead of in worker processes
+        self.workers: int = configuration.get("analysis_workers", max(1, (os.cpu_count() or 2) - 1)) if workers is None else workers
+        self.timeout: float = configuration.get("analysis_timeout", 120) if timeout is None else timeout
+        self._executor: Executor | None = None
+        # Bumped whenever the pool is replaced, so a job that lost its worker to somebody else's timeout can tell
+        self._pool_generation = 0
+
+    @property
+    def executor(self) -> Executor | None:
+        if self._executor is None and self.workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            executor = self.executor
+            generation = self._pool_generation
+            try:
+                return await asyncio.wait_for(loop.run_in_executor(executor, func, *args), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                # wait_for only stops waiting, the worker would keep going and hold its slot for good
+                self.recycle(executor)
+                raise
+            except BrokenProcessPool:
+                if generation != self._pool_generation and attempt == 0:
+                    # Killed along with a job that timed out, this one gets another go on the fresh pool
+                    continue
+                # A worker died (OOM, segfault in a C extension...), start a fresh pool for the next job
+                self.recycle(executor)
+                raise
+
+    def recycle(self, executor: Executor | None) -> None:
+        if executor is None or executor is not self._executor:
+            return
+        self._executor = None
+        self._pool_generation += 1
+        processes = getattr(executor, "_processes", None) or {}
+        for process in list(processes.values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Everything below runs inside the worker processes, so it must stay picklable and free of bot state.
+
+def parse_apworld(path: str, report_id: int, rename_locals: bool = False, write_sidecars: bool = False) -> tuple[Report, dict[str, Any] | None]:
+    checksums: dict[str, int] = {}
+    hook_checksums: dict[str, str] = {}
+    hook_sources: dict[str, str] = {}
+    jsons = {}
+    errors = {}
+    asts: dict[str, ast.Module] = {}
+
+    report = Report(report_id, path, os.path.basename(path), None, errors)
+
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            if info.filename.startswith("__MACOSX"):
+                continue
+            p = pathlib.Path(info.filename)
+            fn = '/'.join(p.parts[1:])
+            if '__pycache__' in fn:
+                continue
+
+            checksums[fn] = info.CRC
+            if fn.endswith(".json"):
+                parse_json_file(jsons, errors, zf, info, fn)
+            elif fn.endswith('.py'):
+                parse_source_code(asts, report, zf, info, fn)
+
+    zp = zipfile.Path(path)
+    if not (zp / zp.filename.stem / "__init__.py").exists():
+        report.errors.setdefault(zp.filename.name, []).append(
+            f"Unexpected Folder Structure found, expected __init__.py in {zp.filename.name}/{zp.filename.stem} but was not found."
+        )
+
+    if not [fn for fn in asts if '/' not in fn]:
+        init_files = [p.filename for p in zf.infolist() if p.filename.endswith('__init__.py')]
+        if not init_files:
+            # Uhhh, there's no python in here.
+            report.errors[os.path.basename(path)] = ['No __init__.py found.  Something has gone terribly wrong.']
+            return report, None
+
+        init_location = init_files[0]
+        subfolder = init_location.split('/')[0] + '/'
+        report.errors[os.path.basename(path)] = [f"__init__.py found in {init_location}, should be in {init_location.removeprefix(subfolder)}"]
+        badfolder = init_location.split('/')[1] + '/'
+        asts = {fn.removeprefix(badfolder): asts[fn] for fn in asts if fn.startswith(badfolder)}
+        checksums = {fn.removeprefix(badfolder): checksums[fn] for fn in checksums if fn.startswith(badfolder)}
+
+    hash_functions(hook_checksums, hook_sources, asts, rename_locals)
+
+    if write_sidecars:
+        # The bot keeps these next to its uploads, the command line checker must not write into its input
+        with open(os.path.join(os.path.splitext(path)[0] + ".checksums"), "w") as f:
+            json.dump(checksums, f, indent=1)
+        with open(os.path.join(os.path.splitext(path)[0] + ".hooks"), "w") as f:
+            json.dump(hook_checksums, f, indent=1)
+
+    report.load_game(jsons.get("data/game.json", {}))
+    report.checksums = checksums
+    report.hook_checksums = hook_checksums
+    report.hook_sources = hook_sources
+    report.rule_functions = rule_functions(asts, checksums)
+    return report, jsons
+
+
+def validate_tables(report: Report, jsons: dict[str, Any], schemas: dict[str, tuple[dict | None, str | None]]) -> Report:
+    errors = report.errors
+    ap_manifest = None
+    for fn, data in jsons.items():
+        if data is None:
+            continue
+        table = os.path.splitext(os.path.basename(fn))[0]
+        if table == 'events' and 0 < report.numeric_version < 20260129:
+            errors[fn] = ['You are trying to use events.json on a version that does not support events']
+        v = validate_table(table, data, *schemas.get(fn, (None, None)))
+        if v:
+            errors[fn] = v
+        if table == "regions":
+            validate_regions(data, report, jsons.get("data/locations.json"))
+        if fn == "archipelago.json":
+            ap_manifest = data
+
+    validate_requires(jsons, report, report.rule_functions)
+
+    # if not ap_manifest:
+    #     errors["archipelago.json"] = ["Missing archipelago.json"]
+    if ap_manifest and ap_manifest.get("game") != report.name:
+        errors["archipelago.json"] = [f"archipelago.json game field should be `{report.name}`"]
+    return report
+
+
+def parse_json_file(jsons, errors, zf, info, fn):
+    with zf.open(info) as f:
+        try:
+            jsons[fn] = json.load(f)
+        except json.JSONDecodeError as e:
+            print(f"Failed to load {fn}")
+            jsons[fn] = None
+            errors[fn] = [str(e)]
+
+
+def parse_source_code(asts, report, zf, info, fn):
+    try:
+        with zf.open(info) as f:
+            asts[fn] = ast.parse(f.read(), report.filename + '/' + fn)
+    except SyntaxError as e:
+        print(f"Failed to parse {fn}")
+        report.errors[fn] = [str(e)]
+
+
+def rule_functions(asts: dict[str, ast.Module], checksums: dict[str, int]) -> list[str] | None:
+    # What {Function()} calls in requires can resolve to: every name Rules.py and the rules hook define or import.
+    # None when that can't be known (a star import or a file that didn't parse) and the calls can't be checked.
+    names = set()
+    for fn in ("Rules.py", "hooks/Rules.py"):
+        if fn not in checksums:
+            continue
+        if fn not in asts:
+            return None
+        for obj in asts[fn].body:
+            if isinstance(obj, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                names.add(obj.name)
+            elif isinstance(obj, (ast.Import, ast.ImportFrom)):
+                for alias in obj.names:
+                    if alias.name == "*":
+                        return None
+                    names.add(alias.asname or alias.name.split(".")[0])
+            elif isinstance(obj, (ast.Assign, ast.AnnAssign)):
+                for target in obj.targets if isinstance(obj, ast.Assign) else [obj.target]:
+                    names.update(node.id for node in ast.walk(target) if isinstance(node, ast.Name))
+    return sorted(names)
+
+
+def hash_functions(hook_checksums, hook_sources, asts, rename_locals=False):
+    for fn, tree in asts.items():
+        module_name = os.path.splitext(os.path.basename(fn))[0]
+        if fn.startswith('hooks/'):
+            for name, obj in hook_definitions(tree, module_name):
+                source = ast.unparse(obj)
+                hook_checksums[name] = fingerprint_source(source, rename_locals)
+                hook_sources[name] = base64.b64encode(source.encode()).decode()
@@ -1,25 +1,32 @@
+import asyncio
+import contextlib
 import io
 import os
 import re
+import shutil
 import time
 import zipfile
 import json
-import pathlib
 import glob
-import ast
 import base64
-import difflib
 
-import aiohttp
 from interactions.models import Extension, Message, Attachment, DMChannel, ComponentContext, component_callback
 from interactions.models.discord.components import Button, ButtonStyle, spread_to_rows
 from interactions import File, events, listen
+from interactions.client.errors import HTTPException
 from interactions.models.internal import tasks
 
+from . import analysis
+from .hook_diff import DiffCache, render_diff, render_diffs
+from .pipeline import Checker
+from .releases import ReleaseSync
 from .report import Report
-from .validate_logic import validate_regions
-from .schema_validate import validate_json
-from shared import configuration, limited_dict
+from .report_store import ReportStore
+from .result_cache import ResultCache, cache_key
+from .upload_queue import InFlight, WorkQueue
+from .schema_validate import prefetch_schemas
+from shared import configuration, http_client, metrics, startup
+from shared.exceptions import FileTooLargeException
 
 SUPPORT_CHANNELS = [
     1097538232914296944, # manual-dev
@@ -29,28 +36,45 @@ SUPPORT_CHANNELS = [
     1174806714130898964, # Rhythm Game Thread
 ]
 
+QUEUED = "\N{HOURGLASS WITH FLOWING SAND}"
+CHECKING = "\N{LEFT-POINTING MAGNIFYING GLASS}"
+
 class ManualChecker(Extension):
-    known_checksums = {}
-    known_hooks = {}
-    latest_stable = None
-    latest_unstable = None
+    reports = ReportStore(configuration.get("report_store_bytes", 32 * 1024 * 1024), configuration.get("report_ttl", 30 * 24 * 60 * 60))
+    engine = analysis.AnalysisEngine()
+    results = ResultCache()
+    checker = Checker(engine, results, reports, rename_locals=configuration.get("hook_fingerprint_ignore_locals", False), write_sidecars=True)
+    background_tasks: set[asyncio.Task] = set()
+    diffs = DiffCache(configuration.get("hook_diff_cache_size", 512))
+    release_sync = ReleaseSync(engine)
+    uploads = WorkQueue("uploads", configuration.get("upload_workers", 2), configuration.get("upload_queue_size", 20))
+    downloads: InFlight[str] = InFlight("downloads")
+    checks: InFlight[Report] = InFlight("checks")
+
+    def __init__(self, bot) -> None:
+        startup.add("known_versions", self.checker.load_known_versions)
+        startup.add("base_versions", self.warm_up, priority=1, after=("known_versions",))
+        if configuration.get("check_existing_apworlds", False):
+            startup.add("recheck_apworlds", self.check_existing_apworlds, priority=3, after=("base_versions",))
 
-    reports = limited_dict.LimitedSizeDict(size_limit=100)
+    def drop(self) -> None:
+        self.uploads.stop()
+        self.checker.known_versions.close()
+        self.engine.shutdown()
+        asyncio.get_event_loop().create_task(http_client.client.close())
+        super().drop()
 
     @listen()
-    async def on_ready(self, event: events.Ready) -> None:
-        for checksums in glob.glob("checksums/*.checksums"):
-            with open(checksums) as f:
-                data = json.load(f)
-                self.known_checksums[os.path.splitext(os.path.basename(checksums))[0]] = data
-        for checksums in glob.glob("checksums/*.hooks"):
-            with open(checksums) as f:
-                data = json.load(f)
-                self.known_hooks[os.path.splitext(os.path.basename(checksums))[0]] = data
-        await self.download_base_versions()
-        if configuration.get("check_existing_apworlds", False):
-            for apworld in glob.glob("apworlds/*.apworld"):
-                await self.check_apworld(apworld)
+    async def on_startup(self, event: events.Startup) -> None:
+        # Startup only fires once, Ready comes again on every reconnect and would start a second loop
+        self.daily_tasks.start()
+
+    async def warm_up(self) -> None:
+        await asyncio.gather(prefetch_schemas(), self.download_base_versions())
+
+    async def check_existing_apworlds(self) -> None:
+        for apworld in glob.glob("apworlds/**/*.apworld", recursive=True):
+            await self.check_apworld(apworld)
 
     @listen()
     async def on_message(self, event: events.MessageCreate) -> None:
@@ -62,22 +86,66 @@ class ManualChecker(Extension):
         if event.message.attachments:
             for attachment in event.message.attachments:
                 if attachment.filename.endswith(".apworld"):
-                    await self.inspect_apworld(event.message, attachment)
+                    await self.queue_apworld(event.message, attachment)
                     return
 
+    async def queue_apworld(self, message: Message, attachment: Attachment) -> None:
+        # The reaction goes on before the job is queued, so a worker picking it up straight away can't be overtaken
+        if self.uploads.queue.full():
+            await self.reject_busy(message)
+            return
+        await react(message, QUEUED)
+        future = self.uploads.submit(lambda: self.inspect_apworld(message, attachment))
+        if future is None:
+            await unreact(message, QUEUED)
+            await self.reject_busy(message)
+            return
+        await future
+
+    async def reject_busy(self, message: Message) -> None:
+        metrics.count("apworlds_rejected_total", reason="queue_full")
+        await message.reply("Too many apworlds are waiting to be checked right now, please post it again in a few minutes.")
+
     async def inspect_apworld(self, message: Message, attachment: Attachment) -> None:
-        data = await download_apworld(attachment.url)
-        path = os.path.join("apworlds", attachment.filename)
-        with open(path, "wb") as f:
-            f.write(data)
+        await react(message, CHECKING)
+        await unreact(message, QUEUED)
+        try:
+            with metrics.span("manual_checker.inspect_apworld", size=attachment.size):
+                await self._inspect_apworld(message, attachment)
+        finally:
+            await unreact(message, CHECKING)
+
+    async def _inspect_apworld(self, message: Message, attachment: Attachment) -> None:
+        max_size = configuration.get("max_apworld_size", 50 * 1024 * 1024)
+        # Every upload gets its own folder, another one with the same name can't replace it while it waits to be checked
+        path = os.path.join("apworlds", str(attachment.id), os.path.basename(attachment.filename))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            if attachment.size > max_size:
+                raise FileTooLargeException(f"{attachment.filename} is {attachment.size} bytes")
+            with metrics.span("manual_checker.download"):
+                # The query string only carries the link's expiry, the path is what identifies the attachment
+                digest = await self.downloads.run(attachment.url.split("?")[0], lambda: download_apworld(attachment.url, path, max_size))
+        except FileTooLargeException:
+            metrics.count("apworlds_rejected_total", reason="too_large")
+            await message.reply(f"{attachment.filename} is larger than the {max_size // (1024 * 1024)}MB limit, it has not been checked.")
+            return
 
-        report = await self.check_apworld(path)
+        # Identifying the base version before the known versions are in would only report it as unknown
+        await startup.wait("base_versions", configuration.get("startup_wait_timeout", 120))
+        # The same file posted twice under the same name while the first is still being checked shares that check
+        report = await self.checks.run(cache_key(digest, os.path.basename(path)), lambda: self.check_apworld(path, digest))
         components = []
         if report.modified_hook_functions: # or report.modified_hooks:
+            # Render the diffs while the reply goes out, so the buttons answer straight away
+            task = asyncio.create_task(self.precompute_diffs(report))
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
             components.append(Button(label="View Modified Hooks", custom_id=f"view_hooks:{report.id}", style=ButtonStyle.BLURPLE))
         if "Missing archipelago.json" in report.errors.get("archipelago.json", []):
             components.append(Button(label="Add missing archipelago.json", custom_id=f"add_ap_manifest:{report.id}", style=ButtonStyle.GREEN))
         await message.reply(embed=report.to_embed(), components=components)
+        startup.responded_to("apworld_report")
 
 
     @component_callback(re.compile(r"view_hooks:(\d+)"))
@@ -101,18 +169,49 @@ class ManualChecker(Extension):
             return
         index = int(ctx.custom_id.split(":")[2])
         hook_name = report.modified_hook_functions[index]
-        hook = base64.b64decode(report.hook_checksums.get(hook_name).encode()).decode()
-        base = base64.b64decode(self.known_hooks[report.base_version].get(hook_name).encode()).decode()
-        diff = difflib.unified_diff(base.splitlines(), hook.splitlines(), lineterm="")
-        diff_text = "\n".join(diff)
-        if len(diff_text) > 2000:
-            buffer = io.BytesIO()
-            buffer.write(diff_text.encode())
-            buffer.seek(0)
-            diff_file = File(file=buffer, file_name=f"{hook_name}.txt")
-            await ctx.send("", file=diff_file, ephemeral=True)
+        base = self.checker.known_hooks.source_for(report.base_version, hook_name)
+        if hook_name not in report.hook_sources or base is None:
+            await ctx.send(f"The source of {hook_name} is no longer available", ephemeral=True)
+            return
+        key = (self.checker.known_hooks[report.base_version][hook_name], report.hook_checksums[hook_name])
+        diff = self.diffs.get(key)
+        metrics.cache("hook_diff", diff is not None)
+        if diff is None:
+            hook = base64.b64decode(report.hook_sources[hook_name].encode()).decode()
+            diff = render_diff(base, hook, configuration.get("structural_hook_diffs", False))
+            self.diffs[key] = diff
+        if len(diff.text) <= 2000:
+            await ctx.send("```diff\n" + diff.text + "```", ephemeral=True)
+            return
+        diff_file = File(file=io.BytesIO(diff.text.encode()), file_name=f"{hook_name}.txt")
+        if diff.summary and len(diff.summary) <= 1900:
+            # Too long to show inline, but the statement summary usually fits and says enough on its own
+            await ctx.send("```diff\n" + diff.summary + "```", file=diff_file, ephemeral=True)
             return
-        await ctx.send("```diff\n" + diff_text + "```", ephemeral=True)
+        await ctx.send("", file=diff_file, ephemeral=True)
+
+    async def precompute_diffs(self, report: Report) -> None:
+        if report.base_version not in self.checker.known_hooks:
+            return
+        base_hooks = self.checker.known_hooks[report.base_version]
+        pairs = {}
+        for hook_name in report.modified_hook_functions:
+            key = (base_hooks[hook_name], report.hook_checksums[hook_name])
+            if key in self.diffs or key in pairs or hook_name not in report.hook_sources:
+                continue
+            base = self.checker.known_hooks.source_for(report.base_version, hook_name)
+            if base is not None:
+                pairs[key] = (base, base64.b64decode(report.hook_sources[hook_name].encode()).decode())
+        if not pairs:
+            return
+        try:
+            rendered = await self.engine.run(render_diffs, pairs, configuration.get("structural_hook_diffs", False))
+        except Exception as e:
+            # Nothing lost, view_function renders the diff itself on a miss
+            print(f"Failed to precompute hook diffs for report {report.id}: {e!r}")
+            return
+        for key, diff in rendered.items():
+            self.diffs[key] = diff
 
     @component_callback(re.compile(r"add_ap_manifest:(\d+)"))
     async def add_ap_manifest(self, ctx: ComponentContext) -> None:
@@ -133,193 +232,41 @@ class ManualChecker(Extension):
             zf.writestr(filename, json.dumps(ap_manifest, indent=4))
         await ctx.send(content="Updated APWorld with archipelago.json:", file=File(report.path, os.path.basename(report.path)))
 
-    async def check_apworld(self, path: str) -> Report:
-        checksums: dict[str, int] = {}
-        hook_checksums: dict[str, int] = {}
-        jsons = {}
-        errors = {}
-        asts: dict[str, ast.Module] = {}
-
-
-        report_id = int(time.time() % 1735650000)
-        report = Report(report_id, path, os.path.basename(path), None, errors)
-        self.reports[report.id] = report
-
-        with zipfile.ZipFile(path) as zf:
-            for info in zf.infolist():
-                if info.filename.startswith("__MACOSX"):
-                    continue
-                p = pathlib.Path(info.filename)
-                fn = '/'.join(p.parts[1:])
-                if '__pycache__' in fn:
-                    continue
-
-                checksums[fn] = zf.getinfo(info.filename).CRC
-                if fn.endswith(".json"):
-                    self.parse_json_file(jsons, errors, zf, info, fn)
-                elif fn.endswith('.py'):
-                    self.parse_source_code(asts, report, zf, info, fn)
-
-        zp = zipfile.Path(path)
-        if not (zp / zp.filename.stem / "__init__.py").exists():
-            # [:-8] to strip ".apworld" from filename
-            report.errors.setdefault(zp.filename.name,[]).append(f"Unexpected Folder Structure found, expected __init__.py in {zp.filename.name}/{zp.filename.stem} but was not found.")
-
-        if not [fn for fn in asts if '/' not in fn]:
-            init_files = [p.filename for p in zf.infolist() if p.filename.endswith('__init__.py')]
-            if not init_files:
-                # Uhhh, there's no python in here.
-                report.errors[os.path.basename(path)] = ['No __init__.py found.  Something has gone terribly wrong.']
-                return report
-
-            init_location = init_files[0]
-            subfolder = init_location.split('/')[0] + '/'
-            report.errors[os.path.basename(path)] = [f"__init__.py found in {init_location}, should be in {init_location.removeprefix(subfolder)}"]
-            badfolder = init_location.split('/')[1] + '/'
-            asts = {fn.removeprefix(badfolder): asts[fn] for fn in asts if fn.startswith(badfolder)}
-            checksums = {fn.removeprefix(badfolder): checksums[fn] for fn in checksums if fn.startswith(badfolder)}
-
-        self.hash_functions(hook_checksums, asts)
-
-
-        with open(os.path.join(os.path.splitext(path)[0] + ".checksums"), "w") as f:
-            json.dump(checksums, f, indent=1)
-        with open(os.path.join(os.path.splitext(path)[0] + ".hooks"), "w") as f:
-            json.dump(hook_checksums, f, indent=1)
-
-        report.load_game(jsons.get("data/game.json", {}))
-        report.checksums = checksums
-        report.hook_checksums = hook_checksums
-
-        found_version = self.identify_base_version(checksums, report)
-
-        print(f"{path} matches {found_version}")
-        ap_manifest = None
-        for fn, data in jsons.items():
-            if data is None:
-                continue
-            table = os.path.splitext(os.path.basename(fn))[0]
-            if table == 'events' and 0 < report.numeric_version < 20260129:
-                errors[fn] = ['You are trying to use events.json on a version that does not support events']
-            v = await validate_json(table, data)
-            if v:
-                errors[fn] = v
-            if table == "regions":
-                validate_regions(data, report)
-            if fn == "archipelago.json":
-                ap_manifest = data
-
-        # if not ap_manifest:
-        #     errors["archipelago.json"] = ["Missing archipelago.json"]
-        if ap_manifest and ap_manifest.get("game") != report.name:
-            errors["archipelago.json"] = [f"archipelago.json game field should be `{report.name}`"]
-
-        print(errors)
-        return report
-
-    def parse_json_file(self, jsons, errors, zf, info, fn):
-        with zf.open(info) as f:
-            try:
-                jsons[fn] = json.load(f)
-            except json.JSONDecodeError as e:
-                print(f"Failed to load {fn}")
-                jsons[fn] = None
-                errors[fn] = [str(e)]
-
-    def parse_source_code(self, asts, report, zf, info, fn):
-        try:
-            with zf.open(info) as f:
-                asts[fn] = ast.parse(f.read(), report.filename + '/' + fn)
-        except SyntaxError as e:
-            print(f"Failed to parse {fn}")
-            report.errors[fn] = [str(e)]
-
-    def hash_functions(self, hook_checksums, asts):
-        for fn, tree in asts.items():
-            module_name = os.path.splitext(os.path.basename(fn))[0]
-            if fn.startswith('hooks/'):
-                for obj in tree.body:
-                    if isinstance(obj, ast.FunctionDef):
-                        hook_checksums[f'{module_name}.{obj.name}'] = base64.b64encode(ast.unparse(obj).encode()).decode()
-
-
-    def identify_base_version(self, checksums, report: Report) -> str:
-        found_version = None
-        for version, known_checksums in self.known_checksums.items():
-            match = True
-            modified_hooks = []
-            for fn, checksum in checksums.items():
-                if fn not in known_checksums:
-                    continue
-                if fn.startswith("hooks/") and known_checksums[fn] != checksum:
-                    modified_hooks.append(fn)
-                    continue
-                if '/' in fn:
-                    continue
-                else:
-                    if '/' not in fn and known_checksums[fn] != checksum:
-                        # print(f"{path} does not match {version} because {fn} does not match: {known_checksums[fn]} != {checksum}")
-                        match = False
-                        continue
-            if match:
-                found_version = version
-                report.base_version = version
-                report.numeric_version = int(version.split('_')[-1])
-                report.modified_hooks = modified_hooks
-                if found_version == self.latest_stable:
-                    report.latest = "Stable"
-                elif found_version == self.latest_unstable:
-                    report.latest = "Unstable"
-                break
-        if found_version:
-            if found_version in self.known_hooks:
-                for hook, checksum in report.hook_checksums.items():
-                    if hook not in self.known_hooks[found_version]:
-                        continue
-                    elif self.known_hooks[found_version][hook] != checksum:
-                        report.modified_hook_functions.append(hook)
-                        print(f"Hook {hook} has been modified")
-        return found_version
+    async def check_apworld(self, path: str, digest: str | None = None) -> Report:
+        return await self.checker.check_apworld(path, digest)
 
     async def download_base_versions(self):
-        latest_stable = None
-        latest_unstable = None
-        async with aiohttp.ClientSession() as session:
-            async with session.get("https://api.github.com/repos/ManualForArchipelago/Manual/releases") as response:
-                data = await response.json()
-                for release in data:
-                    for asset in release["assets"]:
-                        if asset["name"].endswith(".apworld"):
-                            if latest_unstable is None and latest_stable is None and "unstable" in release["tag_name"]:
-                                latest_unstable = release['tag_name']
-                            elif latest_stable is None and "manual_stable" in release["tag_name"]:
-                                latest_stable = release['tag_name']
-                            path = os.path.join("apworlds", release["tag_name"] + ".apworld")
-                            checksum_path = os.path.join("checksums", f"{release['tag_name']}.checksums")
-                            hooks_path = os.path.join("checksums", f"{release['tag_name']}.hooks")
-                            if os.path.exists(checksum_path) and os.path.exists(hooks_path):
-                                continue
-                            url = asset["browser_download_url"]
-                            if not os.path.exists(path):
-                                data = await download_apworld(url)
-                                with open(path, "wb") as f:
-                                    f.write(data)
-                            report = await self.check_apworld(path)
-
-                            with open(checksum_path, "w") as f:
-                                json.dump(report.checksums, f, indent=1)
-                            with open(hooks_path, "w") as f:
-                                json.dump(report.hook_checksums, f, indent=1)
-                            self.known_checksums[release["tag_name"]] = report.checksums
-        self.latest_stable = latest_stable
-        self.latest_unstable = latest_unstable
+        with metrics.span("manual_checker.download_base_versions"):
+            latest_stable, latest_unstable, added = await self.release_sync.sync()
+        metrics.count("base_versions_added_total", len(added))
+        self.checker.add_known_versions(latest_stable, latest_unstable, added)
 
     @tasks.Task.create(tasks.CronTrigger("0 0 * * *"))
     async def daily_tasks(self) -> None:
         await self.download_base_versions()
+        await asyncio.to_thread(prune_uploads, configuration.get("report_ttl", 30 * 24 * 60 * 60))
+        self.reports.prune()
+        await asyncio.to_thread(self.results.prune, configuration.get("result_cache_ttl", 30 * 24 * 60 * 60), configuration.get("result_cache_bytes", 256 * 1024 * 1024))
+
+
+async def download_apworld(url: str, path: str, max_size: int | None = None) -> str:
+    return await http_client.client.download(url, path, max_size)
+
+
+def prune_uploads(max_age: float) -> None:
+    # Uploads are only needed for as long as their report can still be used
+    cutoff = time.time() - max_age
+    for directory in glob.glob(os.path.join("apworlds", "*", "")):
+        if os.path.getmtime(directory) < cutoff:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+async def react(message: Message, emoji: str) -> None:
+    # Only feedback, a channel that doesn't allow reactions shouldn't stop the check
+    with contextlib.suppress(HTTPException):
+        await message.add_reaction(emoji)
 
 
-async def download_apworld(url) -> bytes:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            return await response.read()
+async def unreact(message: Message, emoji: str) -> None:
+    with contextlib.suppress(HTTPException):
+        await message.remove_reaction(emoji)
@@ -0,0 +1,81 @@
+import ast
+import hashlib
+from typing import Iterator
+
+# Bump when the normalisation changes, so stored fingerprints get recomputed
+FINGERPRINT_VERSION = 1
+
+FUNCTION_TYPES = (ast.FunctionDef, ast.AsyncFunctionDef)
+
+
+def hook_definitions(tree: ast.Module, module_name: str) -> Iterator[tuple[str, ast.stmt]]:
+    for obj in tree.body:
+        if isinstance(obj, FUNCTION_TYPES):
+            yield f'{module_name}.{obj.name}', obj
+        elif isinstance(obj, ast.ClassDef):
+            for method in obj.body:
+                if isinstance(method, FUNCTION_TYPES):
+                    yield f'{module_name}.{obj.name}.{method.name}', method
+        elif isinstance(obj, ast.Assign):
+            for target in obj.targets:
+                if isinstance(target, ast.Name):
+                    yield f'{module_name}.{target.id}', obj
+        elif isinstance(obj, ast.AnnAssign) and isinstance(obj.target, ast.Name) and obj.value is not None:
+            yield f'{module_name}.{obj.target.id}', obj
+
+
+def fingerprint_source(source: str, rename_locals: bool = False) -> str:
+    # Works from source rather than the original node so uploads and the stored release hooks (which only keep
+    # ast.unparse output) always go through exactly the same steps.  ast.dump leaves out positions, so formatting
+    # and comments never reach the digest.
+    tree = ast.parse(source)
+    node = _Normalizer(rename_locals).visit(tree.body[0] if len(tree.body) == 1 else tree)
+    return hashlib.blake2b(ast.dump(node, annotate_fields=False).encode(), digest_size=8).hexdigest()
+
+
+class _Normalizer(ast.NodeTransformer):
+    def __init__(self, rename_locals: bool) -> None:
+        self.rename_locals = rename_locals
+        self.names: dict[str, str] = {}
+
+    def strip_docstring(self, node: ast.AST) -> None:
+        body = node.body
+        if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str):
+            node.body = body[1:] or [ast.Pass()]
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> ast.AST:
+        self.strip_docstring(node)
+        return self.generic_visit(node)
+
+    def visit_FunctionDef(self, node: ast.FunctionDef | ast.AsyncFunctionDef) -> ast.AST:
+        self.strip_docstring(node)
+        if self.rename_locals and not self.names:
+            # Numbered once for the outermost function, nested functions are already covered by the walk
+            self.names = local_names(node)
+        return self.generic_visit(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_arg(self, node: ast.arg) -> ast.AST:
+        node.arg = self.names.get(node.arg, node.arg)
+        return self.generic_visit(node)
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        node.id = self.names.get(node.id, node.id)
+        return node
+
+
+def local_names(function: ast.FunctionDef | ast.AsyncFunctionDef) -> dict[str, str]:
+    # Parameters and anything assigned inside the function, numbered in order of appearance
+    declared = {name for node in ast.walk(function) if isinstance(node, (ast.Global, ast.Nonlocal)) for name in node.names}
+    names: dict[str, str] = {}
+    for node in ast.walk(function):
+        if isinstance(node, ast.arg):
+            name = node.arg
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            name = node.id
+        else:
+            continue
+        if name not in declared and name not in names:
+            names[name] = f'_{len(names)}'
+    return names
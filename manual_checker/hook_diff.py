@@ -0,0 +1,94 @@
+import ast
+import difflib
+from collections import OrderedDict
+from typing import NamedTuple
+
+from .fingerprint import fingerprint_source
+
+
+class HookDiff(NamedTuple):
+    text: str
+    summary: str | None
+
+
+class DiffCache:
+    # The same modified hooks turn up across many uploads (and people click the same button more than once), so
+    # rendered diffs are kept by the fingerprints of both sides rather than by report.
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._diffs: OrderedDict[tuple[str, str], HookDiff] = OrderedDict()
+
+    def __contains__(self, key: tuple[str, str]) -> bool:
+        return key in self._diffs
+
+    def get(self, key: tuple[str, str]) -> HookDiff | None:
+        diff = self._diffs.get(key)
+        if diff is not None:
+            self._diffs.move_to_end(key)
+        return diff
+
+    def __setitem__(self, key: tuple[str, str], diff: HookDiff) -> None:
+        self._diffs[key] = diff
+        self._diffs.move_to_end(key)
+        while len(self._diffs) > self.max_entries:
+            self._diffs.popitem(last=False)
+
+
+def render_diffs(pairs: dict[tuple[str, str], tuple[str, str]], structural: bool) -> dict[tuple[str, str], HookDiff]:
+    # Runs on the analysis engine, pairs maps (base fingerprint, modified fingerprint) to (base source, modified source)
+    return {key: render_diff(base, hook, structural) for key, (base, hook) in pairs.items()}
+
+
+def render_diff(base: str, hook: str, structural: bool) -> HookDiff:
+    text = "\n".join(difflib.unified_diff(base.splitlines(), hook.splitlines(), lineterm=""))
+    summary = None
+    if structural:
+        try:
+            summary = structural_diff(base, hook)
+        except SyntaxError:
+            pass
+    return HookDiff(text, summary)
+
+
+def structural_diff(base: str, hook: str) -> str:
+    # One line per top level statement of the hook body that was added, removed or changed
+    base_node = ast.parse(base).body[0]
+    hook_node = ast.parse(hook).body[0]
+    lines = []
+    signature_changed = False
+    if isinstance(base_node, (ast.FunctionDef, ast.AsyncFunctionDef)) and isinstance(hook_node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        if ast.dump(base_node.args) != ast.dump(hook_node.args) or [ast.dump(d) for d in base_node.decorator_list] != [ast.dump(d) for d in hook_node.decorator_list]:
+            lines.append(f"~ L{hook_node.lineno} signature: {first_line(hook_node)}")
+            signature_changed = True
+        base_body, hook_body = without_docstring(base_node.body), without_docstring(hook_node.body)
+    else:
+        base_body, hook_body = [base_node], [hook_node]
+
+    matcher = difflib.SequenceMatcher(None, [statement_fingerprint(s) for s in base_body], [statement_fingerprint(s) for s in hook_body], autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        if tag == "replace":
+            paired = min(i2 - i1, j2 - j1)
+            lines.extend(f"~ L{s.lineno} {first_line(s)}" for s in hook_body[j1:j1 + paired])
+            i1 += paired
+            j1 += paired
+        lines.extend(f"- L{s.lineno} {first_line(s)}" for s in base_body[i1:i2])
+        lines.extend(f"+ L{s.lineno} {first_line(s)}" for s in hook_body[j1:j2])
+    return f"{len(lines) - signature_changed} of {len(hook_body)} statements changed\n" + "\n".join(lines)
+
+
+def without_docstring(body: list[ast.stmt]) -> list[ast.stmt]:
+    # Docstrings don't count towards the fingerprint either
+    if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str):
+        return body[1:]
+    return body
+
+
+def statement_fingerprint(statement: ast.stmt) -> str:
+    return fingerprint_source(ast.unparse(statement))
+
+
+def first_line(statement: ast.stmt, limit: int = 80) -> str:
+    line = ast.unparse(statement).splitlines()[0]
+    return line if len(line) <= limit else line[:limit - 3] + "..."
@@ -0,0 +1,87 @@
+import base64
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+from .fingerprint import FINGERPRINT_VERSION, fingerprint_source
+
+
+class HookStore:
+    # Most hook bodies are identical from one Manual release to the next, so each distinct body is written once to
+    # cache/hooks under its fingerprint and a version is just a mapping of hook names to fingerprints.  The source itself is
+    # only read back when someone asks for a diff.  KnownVersions keeps the mappings, so unchanged release files are
+    # never parsed again.
+    def __init__(self, directory: str = os.path.join("cache", "hooks"), rename_locals: bool = False) -> None:
+        self.directory = directory
+        self.rename_locals = rename_locals
+        self.versions: dict[str, dict[str, str]] = {}
+        self._interned: dict[str, str] = {}
+        self._origins: dict[str, str] = {}
+        self._sources: OrderedDict[str, str] = OrderedDict()
+        self.max_sources = 256
+
+    def __contains__(self, version: str) -> bool:
+        return version in self.versions
+
+    def __getitem__(self, version: str) -> dict[str, str]:
+        return self.versions[version]
+
+    @property
+    def settings(self) -> str:
+        return f"{FINGERPRINT_VERSION}:{self.rename_locals}"
+
+    def add(self, version: str, hooks: dict[str, str], origin: str | None = None) -> None:
+        self.set_version(version, {name: self.put(encoded) for name, encoded in hooks.items()}, origin)
+
+    def set_version(self, version: str, digests: dict[str, str], origin: str | None) -> None:
+        self.versions[version] = {name: self._interned.setdefault(digest, digest) for name, digest in digests.items()}
+        if origin:
+            self._origins[version] = origin
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest + ".py")
+
+    def put(self, encoded_source: str) -> str:
+        source = base64.b64decode(encoded_source.encode()).decode()
+        try:
+            digest = fingerprint_source(source, self.rename_locals)
+        except SyntaxError:
+            digest = hashlib.blake2b(source.encode(), digest_size=8).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(source)
+            os.replace(path + ".tmp", path)
+        return digest
+
+    def source_for(self, version: str, hook: str) -> str | None:
+        digest = self.versions.get(version, {}).get(hook)
+        if digest is None:
+            return None
+        source = self.source(digest)
+        if source is None and version in self._origins:
+            # The body cache was cleared underneath us, fall back to the release file
+            with open(self._origins[version]) as f:
+                encoded = json.load(f).get(hook)
+            if encoded:
+                self.put(encoded)
+                source = base64.b64decode(encoded.encode()).decode()
+        return source
+
+    def source(self, digest: str) -> str | None:
+        # Only bodies that were found are remembered, a missing one is looked for again once source_for has put it back
+        source = self._sources.get(digest)
+        if source is not None:
+            self._sources.move_to_end(digest)
+            return source
+        try:
+            with open(self._path(digest), encoding="utf-8") as f:
+                source = f.read()
+        except FileNotFoundError:
+            return None
+        self._sources[digest] = source
+        if len(self._sources) > self.max_sources:
+            self._sources.popitem(last=False)
+        return source
@@ -0,0 +1,108 @@
+import json
+import os
+import sqlite3
+
+from .hook_store import HookStore
+from .version_index import VersionIndex
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    version TEXT PRIMARY KEY,
+    checksums_mtime INTEGER NOT NULL,
+    hooks_mtime INTEGER NOT NULL,
+    checksums TEXT NOT NULL,
+    hooks TEXT NOT NULL
+);
+"""
+SCHEMA_VERSION = 1
+
+
+class KnownVersions:
+    # Every release's file checksums and hook fingerprints in one SQLite file, so startup is a single query however
+    # many releases there are.  A release is only parsed again from checksums/ when its .checksums or .hooks file
+    # changed since it was stored, and everything is rebuilt when the schema, the source directory or the hook
+    # fingerprint settings change.
+    def __init__(self, directory: str = "checksums", path: str = os.path.join("cache", "known_versions.db")) -> None:
+        self.directory = directory
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self._db.executescript("DROP TABLE IF EXISTS meta; DROP TABLE IF EXISTS versions;")
+            self._db.executescript(SCHEMA)
+            self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return self._db
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def sources(self) -> dict[str, tuple[int, int]]:
+        # version -> (.checksums mtime, .hooks mtime) for every release that has both files
+        mtimes: dict[str, dict[str, int]] = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                version, extension = os.path.splitext(entry.name)
+                if extension in (".checksums", ".hooks"):
+                    mtimes.setdefault(version, {})[extension] = entry.stat().st_mtime_ns
+        return {version: (found[".checksums"], found[".hooks"]) for version, found in mtimes.items() if len(found) == 2}
+
+    def load(self, index: VersionIndex, hooks: HookStore) -> None:
+        meta = {"directory": os.path.abspath(self.directory), "hook_settings": hooks.settings}
+        with self.db:
+            if dict(self.db.execute("SELECT key, value FROM meta").fetchall()) != meta:
+                self.db.execute("DELETE FROM versions")
+                self.db.execute("DELETE FROM meta")
+                self.db.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", meta.items())
+
+        sources = self.sources()
+        stored = set()
+        for version, checksums_mtime, hooks_mtime, checksums, digests in self.db.execute("SELECT * FROM versions").fetchall():
+            if sources.get(version) != (checksums_mtime, hooks_mtime):
+                continue
+            stored.add(version)
+            index.add(version, json.loads(checksums))
+            hooks.set_version(version, json.loads(digests), self.origin(version))
+
+        stale = [version for version in sources if version not in stored]
+        for version in stale:
+            with open(os.path.join(self.directory, f"{version}.checksums")) as f:
+                checksums = json.load(f)
+            with open(self.origin(version)) as f:
+                hooks.add(version, json.load(f), self.origin(version))
+            index.add(version, checksums)
+        with self.db:
+            self.db.executemany("DELETE FROM versions WHERE version = ?", [(version,) for version in set(self.stored_versions()) - set(sources)])
+            for version in stale:
+                self._store(version, sources[version], index.versions[version], hooks[version])
+        if stale:
+            print(f"Stored {len(stale)} base versions in {self.path}")
+
+    def stored_versions(self) -> list[str]:
+        return [row[0] for row in self.db.execute("SELECT version FROM versions")]
+
+    def store(self, version: str, checksums: dict[str, int], hook_digests: dict[str, str]) -> None:
+        # Called after the release files have been written, so their mtimes are the ones a later load compares
+        mtimes = (os.stat(os.path.join(self.directory, f"{version}.checksums")).st_mtime_ns, os.stat(self.origin(version)).st_mtime_ns)
+        with self.db:
+            self._store(version, mtimes, checksums, hook_digests)
+
+    def _store(self, version: str, mtimes: tuple[int, int], checksums: dict[str, int], hook_digests: dict[str, str]) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO versions (version, checksums_mtime, hooks_mtime, checksums, hooks) VALUES (?, ?, ?, ?, ?)",
+            (version, *mtimes, json.dumps(checksums, separators=(",", ":")), json.dumps(hook_digests, separators=(",", ":"))),
+        )
+
+    def origin(self, version: str) -> str:
+        return os.path.join(self.directory, f"{version}.hooks")
@@ -0,0 +1,289 @@
+import argparse
+import asyncio
+import glob
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+
+from shared import metrics
+
+from . import analysis, schema_validate
+from .hook_store import HookStore
+from .known_versions import KnownVersions
+from .report import Report
+from .report_store import ReportStore
+from .result_cache import ResultCache, cache_key, file_digest
+from .schema_validate import SCHEMAS, SCHEMA_DIGESTS, STANDARD_TABLES, resolve_schema
+from .version_index import VersionIndex, numeric_version
+
+
+class Checker:
+    # The checking pipeline on its own, the bot wraps it with Discord and the command line below runs it over
+    # directories.  Reports are only kept in a ReportStore when one is given.
+    def __init__(
+        self,
+        engine: analysis.AnalysisEngine,
+        results: ResultCache | None = None,
+        reports: ReportStore | None = None,
+        rename_locals: bool = False,
+        write_sidecars: bool = False,
+    ) -> None:
+        self.engine = engine
+        self.write_sidecars = write_sidecars
+        self.results = results
+        self.reports = reports
+        self.known_checksums = VersionIndex()
+        self.known_hooks = HookStore(rename_locals=rename_locals)
+        self.known_versions = KnownVersions()
+        self.latest_stable: str | None = None
+        self.latest_unstable: str | None = None
+        self._ids = itertools.count(1)
+
+    def load_known_versions(self, directory: str = "checksums") -> None:
+        with metrics.span("manual_checker.load_known_versions"):
+            self.known_versions = KnownVersions(directory)
+            self.known_versions.load(self.known_checksums, self.known_hooks)
+
+    def add_known_versions(self, latest_stable: str | None, latest_unstable: str | None, added: dict[str, tuple[dict[str, int], dict[str, str]]]) -> None:
+        # Applied without yielding to the loop, so a check never sees half of a sync
+        for tag, (checksums, hook_sources) in added.items():
+            self.known_checksums.add(tag, checksums)
+            self.known_hooks.add(tag, hook_sources, self.known_versions.origin(tag))
+            self.known_versions.store(tag, checksums, self.known_hooks[tag])
+        self.latest_stable = latest_stable
+        self.latest_unstable = latest_unstable
+
+    def new_id(self) -> int:
+        return self.reports.new_id() if self.reports is not None else next(self._ids)
+
+    def remember(self, report: Report) -> None:
+        if self.reports is not None:
+            self.reports[report.id] = report
+
+    async def check_apworld(self, path: str, digest: str | None = None) -> Report:
+        with metrics.span("manual_checker.check_apworld"):
+            report = await self._check_apworld(path, digest)
+        metrics.count("apworlds_checked_total", result="errors" if report.errors else "clean")
+        return report
+
+    async def _check_apworld(self, path: str, digest: str | None = None) -> Report:
+        report_id = self.new_id()
+        generation = self.generation()
+        if self.results is not None:
+            if digest is None:
+                with metrics.span("manual_checker.digest"):
+                    digest = await asyncio.to_thread(file_digest, path)
+            key = cache_key(digest, os.path.basename(path))
+            report = self.results.get(key, generation, SCHEMA_DIGESTS)
+            metrics.cache("result_cache", report is not None)
+            if report:
+                print(f"{path} matches cached result {digest}")
+                report.id = report_id
+                report.path = path
+                self.remember(report)
+                return report
+
+        used_schemas = {}
+        try:
+            # Unzipping, AST parsing and hook fingerprinting all happen in this one worker call
+            with metrics.span("manual_checker.parse"):
+                report, jsons = await self.engine.run(analysis.parse_apworld, path, report_id, self.known_hooks.rename_locals, self.write_sidecars)
+            self.remember(report)
+            if jsons is not None:
+                with metrics.span("manual_checker.identify"):
+                    found_version = self.identify_base_version(report.checksums, report)
+                print(f"{path} matches {found_version}")
+                # Only modified hooks can be viewed, no point keeping every other source around with the report
+                report.hook_sources = {hook: report.hook_sources[hook] for hook in report.modified_hook_functions if hook in report.hook_sources}
+
+                schemas = {}
+                with metrics.span("manual_checker.schema_fetch"):
+                    for fn, data in jsons.items():
+                        if data is None:
+                            continue
+                        table = os.path.splitext(os.path.basename(fn))[0]
+                        url = await resolve_schema(table, data)
+                        if url:
+                            used_schemas[url] = SCHEMA_DIGESTS[url]
+                        elif table in STANDARD_TABLES:
+                            report.unvalidated_tables.append(fn)
+                            report.warnings.setdefault(fn, []).append("No schema was available, this table has not been validated")
+                        schemas[fn] = (SCHEMAS.get(url), SCHEMA_DIGESTS.get(url))
+                with metrics.span("manual_checker.validate"):
+                    report = await self.engine.run(analysis.validate_tables, report, jsons, schemas)
+        except asyncio.TimeoutError:
+            metrics.count("analysis_timeouts_total")
+            report = Report(report_id, path, os.path.basename(path), None, {os.path.basename(path): [f"Analysis timed out after {self.engine.timeout} seconds"]})
+            self.remember(report)
+            return report
+        self.remember(report)
+        # A report missing schema validation would otherwise be served from the cache once the schemas are back
+        if self.results is not None and not report.unvalidated_tables:
+            self.results.put(key, generation, used_schemas, report)
+
+        print(report.errors)
+        return report
+
+    def generation(self) -> str:
+        # Changes whenever a base version is added, the latest stable/unstable release moves, hooks get fingerprinted
+        # differently or the checks themselves change
+        versions = sorted(self.known_checksums.versions) + [str(self.latest_stable), str(self.latest_unstable), self.known_hooks.settings, f"analysis {analysis.ANALYSIS_VERSION}"]
+        return hashlib.sha256("\n".join(versions).encode()).hexdigest()
+
+    def identify_base_version(self, checksums, report: Report) -> str:
+        match = self.known_checksums.identify(checksums)
+        if match.version is None:
+            report.closest_version = match.closest
+            report.similarity = match.similarity
+            if match.closest:
+                print(f"No base version matches, closest is {match.closest} ({match.similarity:.0%} similar)")
+            return None
+
+        found_version = match.version
+        known_checksums = self.known_checksums.versions[found_version]
+        report.base_version = found_version
+        report.numeric_version = numeric_version(found_version)
+        report.similarity = match.similarity
+        report.modified_hooks = [fn for fn, checksum in checksums.items() if fn.startswith("hooks/") and known_checksums.get(fn, checksum) != checksum]
+        if found_version == self.latest_stable:
+            report.latest = "Stable"
+        elif found_version == self.latest_unstable:
+            report.latest = "Unstable"
+        if found_version in self.known_hooks:
+            base_hooks = self.known_hooks[found_version]
+            for hook, checksum in report.hook_checksums.items():
+                if hook not in base_hooks:
+                    continue
+                elif base_hooks[hook] != checksum:
+                    report.modified_hook_functions.append(hook)
+                    print(f"Hook {hook} has been modified")
+        return found_version
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Check apworlds without the bot")
+    parser.add_argument("paths", nargs="+", help="apworld files or directories containing them")
+    parser.add_argument("--output", default="reports", help="directory for the per-file reports and summary.json")
+    parser.add_argument("--checksums", default="checksums", help="known base versions")
+    parser.add_argument("--schemas", help="directory of Manual.<table>.schema.json files, used before the schema cache")
+    parser.add_argument("--online", action="store_true", help="fetch schemas that aren't cached instead of skipping validation against them")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="worker processes, 0 runs everything in this process")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds allowed per analysis stage")
+    parser.add_argument("--ignore-locals", action="store_true", help="don't count renamed parameters and locals as hook modifications")
+    parser.add_argument("--exit-zero", action="store_true", help="exit with 0 even when some apworlds have errors")
+    parser.add_argument("--write-sidecars", action="store_true", help="write .checksums and .hooks files next to each apworld, like the bot does")
+    return parser.parse_args(argv)
+
+
+def find_apworlds(paths: list[str]) -> dict[str, str]:
+    # apworld -> the name of its report, taken relative to the argument it was found under rather than the cwd
+    found = {}
+    names = set()
+    for path in paths:
+        if os.path.isdir(path):
+            parent = os.path.dirname(os.path.abspath(path))
+            apworlds = [(apworld, os.path.relpath(apworld, parent)) for apworld in sorted(glob.glob(os.path.join(path, "**", "*.apworld"), recursive=True))]
+        else:
+            apworlds = [(path, os.path.basename(path))]
+        for apworld, relative in apworlds:
+            name = base = os.path.splitext(relative)[0].replace(os.sep, "__")
+            for i in itertools.count(2):
+                if name not in names:
+                    break
+                name = f"{base}_{i}"
+            names.add(name)
+            found[apworld] = name
+    return found
+
+
+def load_schema_directory(directory: str) -> None:
+    for path in glob.glob(os.path.join(directory, "Manual.*.schema.json")):
+        table = os.path.basename(path).removeprefix("Manual.").removesuffix(".schema.json")
+        with open(path) as f:
+            schema_validate.use_schema(schema_validate.schema_url(table), f.read())
+
+
+async def check_all(args: argparse.Namespace, apworlds: dict[str, str]) -> list[dict]:
+    engine = analysis.AnalysisEngine(workers=args.jobs, timeout=args.timeout)
+    checker = Checker(engine, rename_locals=args.ignore_locals, write_sidecars=args.write_sidecars)
+    checker.load_known_versions(args.checksums)
+    if args.schemas:
+        load_schema_directory(args.schemas)
+    schema_validate.OFFLINE = not args.online
+    # Enough in flight to keep every worker busy while the loop does the schema and identification steps
+    limit = asyncio.Semaphore(max(1, args.jobs) * 2)
+
+    async def check(path: str, name: str) -> dict:
+        async with limit:
+            start = time.perf_counter()
+            try:
+                report = await checker.check_apworld(path)
+            except Exception as e:
+                report = Report(0, path, os.path.basename(path), None, {os.path.basename(path): [f"Could not be checked: {e!r}"]})
+            elapsed = time.perf_counter() - start
+        with open(os.path.join(args.output, name + ".json"), "w") as f:
+            json.dump(report.to_dict(), f, indent=1)
+        return {
+            "path": path,
+            "name": report.name,
+            "base_version": report.base_version,
+            "closest_version": report.closest_version,
+            "errors": sum(len(errors) for errors in report.errors.values()),
+            "warnings": sum(len(warnings) for warnings in report.warnings.values()),
+            "modified_hook_functions": report.modified_hook_functions,
+            "unvalidated_tables": report.unvalidated_tables,
+            "seconds": elapsed,
+        }
+
+    try:
+        return await asyncio.gather(*(check(path, name) for path, name in apworlds.items()))
+    finally:
+        engine.shutdown()
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    apworlds = find_apworlds(args.paths)
+    if not apworlds:
+        raise SystemExit("No apworlds found")
+    if args.schemas and not os.path.isdir(args.schemas):
+        raise SystemExit(f"{args.schemas} is not a directory")
+    os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    # The pipeline logs its progress with print, the summary is what belongs on stdout
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        results = asyncio.run(check_all(args, apworlds))
+    finally:
+        sys.stdout = stdout
+    # Without --schemas or --online a clean checkout has no schemas at all, passing would only mean nothing was validated
+    strict = not (args.schemas or args.online)
+    for result in results:
+        result["failed"] = bool(result["errors"] or (strict and result["unvalidated_tables"]))
+    summary = {
+        "checked": len(results),
+        "with_errors": sum(1 for result in results if result["failed"]),
+        "unvalidated": sum(1 for result in results if result["unvalidated_tables"]),
+        "seconds": time.perf_counter() - start,
+        "results": results,
+    }
+    with open(os.path.join(args.output, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=1)
+
+    for result in results:
+        version = result["base_version"] or (f"unknown, closest {result['closest_version']}" if result["closest_version"] else "unknown")
+        print(f"{'FAIL' if result['failed'] else 'ok  '} {result['path']} ({version}): {result['errors']} errors, {result['warnings']} warnings")
+    print(f"{summary['checked']} checked, {summary['with_errors']} with errors in {summary['seconds']:.1f}s")
+    if summary["unvalidated"]:
+        print(f"{summary['unvalidated']} apworlds have tables that were not validated, no schema was available for them. Pass --schemas DIR or --online.")
+    if summary["with_errors"] and not args.exit_zero:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import os
+import time
+
+from shared import configuration, http_client
+
+from . import analysis
+
+RELEASES_URL = "https://api.github.com/repos/ManualForArchipelago/Manual/releases?per_page=100"
+
+
+class ReleaseSync:
+    # Keeps a local copy of the Manual release list.  The first page is requested with If-None-Match, and as GitHub
+    # lists releases newest first an unchanged first page means nothing needs to be downloaded at all.
+    def __init__(self, engine: analysis.AnalysisEngine, state_path: str = os.path.join("cache", "releases.json")) -> None:
+        self.engine = engine
+        self.state_path = state_path
+
+    def load_state(self) -> dict:
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save_state(self, state: dict) -> None:
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    async def fetch_releases(self) -> list[dict]:
+        state = self.load_state()
+        headers = {"Accept": "application/vnd.github+json"}
+        if state.get("etag") and "releases" in state:
+            headers["If-None-Match"] = state["etag"]
+
+        releases = []
+        url = RELEASES_URL
+        etag = None
+        while url:
+            async with http_client.client.get(url, headers) as response:
+                if response.status == 304:
+                    return state["releases"]
+                response.raise_for_status()
+                if etag is None:
+                    etag = response.headers.get("ETag")
+                releases.extend(
+                    {
+                        "tag_name": release["tag_name"],
+                        "assets": [{"name": asset["name"], "browser_download_url": asset["browser_download_url"]} for asset in release["assets"]],
+                    }
+                    for release in await response.json()
+                )
+                url = response.links.get("next", {}).get("url")
+            headers = {"Accept": "application/vnd.github+json"}
+        self.save_state({"etag": etag, "fetched_at": time.time(), "releases": releases})
+        return releases
+
+    async def sync(self) -> tuple[str | None, str | None, dict[str, tuple[dict[str, int], dict[str, str]]]]:
+        releases = await self.fetch_releases()
+        latest_stable = None
+        latest_unstable = None
+        missing = []
+        for release in releases:
+            for asset in release["assets"]:
+                if asset["name"].endswith(".apworld"):
+                    if latest_unstable is None and latest_stable is None and "unstable" in release["tag_name"]:
+                        latest_unstable = release['tag_name']
+                    elif latest_stable is None and "manual_stable" in release["tag_name"]:
+                        latest_stable = release['tag_name']
+                    checksum_path = os.path.join("checksums", f"{release['tag_name']}.checksums")
+                    hooks_path = os.path.join("checksums", f"{release['tag_name']}.hooks")
+                    if not (os.path.exists(checksum_path) and os.path.exists(hooks_path)):
+                        missing.append((release["tag_name"], asset["browser_download_url"]))
+
+        limit = asyncio.Semaphore(configuration.get("release_sync_concurrency", 4))
+        results = await asyncio.gather(*(self.fingerprint(limit, tag, url) for tag, url in missing), return_exceptions=True)
+        added = {}
+        for (tag, _url), result in zip(missing, results):
+            if isinstance(result, BaseException):
+                print(f"Failed to fingerprint {tag}: {result!r}")
+            else:
+                added[tag] = result
+        return latest_stable, latest_unstable, added
+
+    async def fingerprint(self, limit: asyncio.Semaphore, tag: str, url: str) -> tuple[dict[str, int], dict[str, str]]:
+        async with limit:
+            path = os.path.join("apworlds", tag + ".apworld")
+            if not os.path.exists(path):
+                await http_client.client.download(url, path)
+            report, _jsons = await self.engine.run(analysis.parse_apworld, path, 0)
+
+        # Release hooks keep their full source, they are what modified hooks get diffed against
+        with open(os.path.join("checksums", f"{tag}.checksums"), "w") as f:
+            json.dump(report.checksums, f, indent=1)
+        with open(os.path.join("checksums", f"{tag}.hooks"), "w") as f:
+            json.dump(report.hook_sources, f, indent=1)
+        print(f"Added base version {tag}")
+        return report.checksums, report.hook_sources
@@ -1,6 +1,14 @@
 import os
+from typing import TYPE_CHECKING
+
 import attrs
-from interactions.models import Embed
+
+if TYPE_CHECKING:
+    from interactions.models import Embed
+
+EMBED_LIMIT = 6000
+EMBED_FIELDS = 25
+MORE_RESERVE = 100
 
 @attrs.define()
 class Report:
@@ -13,9 +21,15 @@ class Report:
     modified_hooks: list[str] = attrs.field(factory=list)
     checksums: dict[str, int] = attrs.field(factory=dict)
     hook_checksums: dict[str, str] = attrs.field(factory=dict)
+    hook_sources: dict[str, str] = attrs.field(factory=dict)
     modified_hook_functions: list[str] = attrs.field(factory=list)
     latest: str = attrs.field(default=None)
     numeric_version: int = attrs.field(default=0)
+    closest_version: str = attrs.field(default=None)
+    similarity: float = attrs.field(default=0.0)
+    warnings: dict[str, list[str]] = attrs.field(factory=dict)
+    rule_functions: list[str] | None = attrs.field(factory=list)
+    unvalidated_tables: list[str] = attrs.field(factory=list)
 
     def load_game(self, game_table: dict):
         if game_table is None:
@@ -25,22 +39,62 @@ class Report:
         if game and creator:
             self.name = f"Manual_{game}_{creator}"
 
-    def to_embed(self) -> Embed:
+    def to_embed(self) -> "Embed":
+        # Imported here so the workers and the command line checker can load reports without the Discord library
+        from interactions.models import Embed
+
         embed = Embed(title=self.name)
         ver = self.base_version
         if self.latest:
             ver += f" (Latest {self.latest})"
-        embed.add_field(name="Manual Version", value=ver or "Unknown")
+        if not ver and self.closest_version:
+            ver = f"Unknown (closest: {self.closest_version}, {self.similarity:.0%} similar)"
+        fields = [("Manual Version", ver or "Unknown")]
         #if self.name.lower() not in self.filename.lower():
         #    self.errors[self.filename] = [f"Filename should be {self.name.lower()}.apworld"]
         for fn, errors in self.errors.items():
-            embed.add_field(name=f'{fn} errors', value="\n".join(f'`{e}`' for e in errors), inline=False)
+            fields.append((f'{fn} errors', field_value([f'`{e}`' for e in errors])))
+        for fn, warnings in self.warnings.items():
+            fields.append((f'{fn} warnings', field_value([f'`{w}`' for w in warnings])))
         if self.modified_hooks:
-            embed.add_field(name="Modified Hook Files", value="\n".join(self.modified_hooks), inline=False)
+            fields.append(("Modified Hook Files", field_value(self.modified_hooks)))
         if self.modified_hook_functions:
-            embed.add_field(name="Modified Hook Functions", value="\n".join(self.modified_hook_functions), inline=False)
+            fields.append(("Modified Hook Functions", field_value(self.modified_hook_functions)))
+
+        # Discord refuses the whole embed past 6000 characters or 25 fields, so whatever doesn't fit is only counted,
+        # with room always kept for the line saying so
+        total = len(embed.title or "")
+        for i, (name, value) in enumerate(fields):
+            last = i == len(fields) - 1
+            if len(embed.fields) >= EMBED_FIELDS - (not last) or total + len(name) + len(value) > EMBED_LIMIT - (0 if last else MORE_RESERVE):
+                more = len(fields) - i
+                embed.add_field(name="More", value=f"...and {more} more section{'s' if more > 1 else ''} that didn't fit, fix the ones above and check again", inline=False)
+                break
+            embed.add_field(name=name, value=value, inline=False)
+            total += len(name) + len(value)
         return embed
 
+    def to_dict(self) -> dict:
+        return attrs.asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Report":
+        return cls(**data)
+
     @property
     def filename(self) -> str:
         return os.path.basename(self.path)
+
+
+def field_value(lines: list[str], limit: int = 1024) -> str:
+    # Embed fields are capped at 1024 characters, schema validation can easily produce more than that
+    value = "\n".join(lines)
+    if len(value) <= limit:
+        return value
+    kept = []
+    for i, line in enumerate(lines):
+        suffix = f"...and {len(lines) - i} more"
+        if len("\n".join(kept + [line, suffix])) > limit:
+            return "\n".join(kept + [suffix])
+        kept.append(line)
+    return value
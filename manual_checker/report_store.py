@@ -0,0 +1,94 @@
+import json
+import os
+import time
+import zlib
+from collections import OrderedDict
+
+from shared import metrics
+
+from .report import Report
+
+
+class ReportStore:
+    # Reports back the "View Modified Hooks" and "Add missing archipelago.json" buttons, which can be clicked long
+    # after the upload.  Every report is written to disk in compressed form, memory only keeps the most recently
+    # used ones up to a byte budget, and anything older than the ttl is gone for good.
+    def __init__(self, max_bytes: int, ttl: float, directory: str = os.path.join("cache", "reports")) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self._reports: OrderedDict[int, tuple[Report, int, float]] = OrderedDict()
+        self._bytes = 0
+        self._last_id = 0
+
+    def new_id(self) -> int:
+        # Millisecond timestamps, bumped when two uploads land in the same millisecond
+        report_id = max(time.time_ns() // 1_000_000, self._last_id + 1)
+        while os.path.exists(self._path(report_id)):
+            report_id += 1
+        self._last_id = report_id
+        return report_id
+
+    def _path(self, report_id: int) -> str:
+        return os.path.join(self.directory, f"{report_id}.json.z")
+
+    def __setitem__(self, report_id: int, report: Report) -> None:
+        created = self._reports[report_id][2] if report_id in self._reports else time.time()
+        data = json.dumps({"created": created, "report": report.to_dict()}, separators=(",", ":")).encode()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(report_id) + ".tmp", "wb") as f:
+            f.write(zlib.compress(data))
+        os.replace(self._path(report_id) + ".tmp", self._path(report_id))
+        self._remember(report_id, report, len(data), created)
+
+    def __contains__(self, report_id: int) -> bool:
+        return self.get(report_id) is not None
+
+    def get(self, report_id: int, default: Report | None = None) -> Report | None:
+        if report_id in self._reports:
+            report, _size, created = self._reports[report_id]
+            if time.time() - created < self.ttl:
+                self._reports.move_to_end(report_id)
+                metrics.cache("report_store", True)
+                return report
+            self._forget(report_id)
+        metrics.cache("report_store", False)
+        try:
+            with open(self._path(report_id), "rb") as f:
+                data = zlib.decompress(f.read())
+        except (FileNotFoundError, zlib.error):
+            return default
+        entry = json.loads(data)
+        if time.time() - entry["created"] >= self.ttl:
+            self._delete(report_id)
+            return default
+        report = Report.from_dict(entry["report"])
+        self._remember(report_id, report, len(data), entry["created"])
+        return report
+
+    def _remember(self, report_id: int, report: Report, size: int, created: float) -> None:
+        self._forget(report_id)
+        self._reports[report_id] = (report, size, created)
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._reports) > 1:
+            self._forget(next(iter(self._reports)))
+
+    def _forget(self, report_id: int) -> None:
+        if report_id in self._reports:
+            self._bytes -= self._reports.pop(report_id)[1]
+
+    def _delete(self, report_id: int) -> None:
+        self._forget(report_id)
+        try:
+            os.remove(self._path(report_id))
+        except FileNotFoundError:
+            pass
+
+    def prune(self) -> None:
+        if not os.path.isdir(self.directory):
+            return
+        cutoff = time.time() - self.ttl
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if filename.endswith(".json.z") and os.path.getmtime(path) < cutoff:
+                self._delete(int(filename.removesuffix(".json.z")))
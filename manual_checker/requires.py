@@ -0,0 +1,132 @@
+import functools
+import re
+from collections import defaultdict
+from typing import Any, Iterator, NamedTuple
+
+from .report import Report
+from .validate_logic import rows, truncate
+
+FUNCTION = re.compile(r"\{\s*(\w+)\s*\((.*?)\)\s*\}")
+REFERENCE = re.compile(r"\|(@?)([^|]*)\|")
+COUNT = re.compile(r"\s*(\d+|ALL|HALF|\d+%)\s*", re.IGNORECASE)
+OPERATORS = re.compile(r"\b(?:and|or|AND|OR)\b|[()\s]")
+
+
+class Requires(NamedTuple):
+    items: tuple[str, ...]
+    categories: tuple[str, ...]
+    functions: tuple[str, ...]
+    errors: tuple[str, ...]
+
+
+@functools.lru_cache(maxsize=8192)
+def parse_requires(expression: str) -> Requires:
+    # Big manuals repeat the same few requires strings over and over, so each distinct one is only parsed once
+    items: list[str] = []
+    categories: list[str] = []
+    functions: list[str] = []
+    errors: list[str] = []
+
+    def references(text: str) -> None:
+        for match in REFERENCE.finditer(text):
+            name = match.group(2)
+            head, colon, count = name.rpartition(":")
+            if colon and COUNT.fullmatch(count):
+                name = head
+            name = name.strip()
+            if not name:
+                errors.append(f"Empty reference {match.group(0)}")
+            elif match.group(1):
+                categories.append(name)
+            else:
+                items.append(name)
+
+    for match in FUNCTION.finditer(expression):
+        functions.append(match.group(1))
+        # Function arguments are passed through as text, but item references in them still have to exist
+        references(match.group(2))
+    rest = FUNCTION.sub(" ", expression)
+    references(rest)
+    rest = REFERENCE.sub(" ", rest)
+
+    depth = 0
+    for char in rest:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth < 0:
+                break
+    if depth != 0:
+        errors.append("Unbalanced parentheses")
+    leftover = OPERATORS.sub("", rest)
+    if leftover:
+        errors.append(f"Unexpected {leftover[:40]!r}, item names go between |pipes| and functions between {{braces}}")
+    return Requires(tuple(items), tuple(categories), tuple(functions), tuple(errors))
+
+
+def iter_requires(requires: Any) -> Iterator[Requires]:
+    # requires is normally one expression, older manuals use a list of item names or of {"or": [...]} groups
+    if isinstance(requires, str):
+        if requires.strip():
+            yield parse_requires(requires)
+    elif isinstance(requires, list):
+        for entry in requires:
+            if isinstance(entry, str):
+                yield parse_requires(entry if "|" in entry or "{" in entry else f"|{entry}|")
+            elif isinstance(entry, dict):
+                yield from iter_requires(entry.get("or", []))
+            elif isinstance(entry, list):
+                yield from iter_requires(entry)
+
+
+def validate_requires(jsons: dict[str, Any], report: Report, functions: list[str] | None) -> None:
+    items = jsons.get("data/items.json")
+    if items is None:
+        return
+    # Name indexes are built once, after that every requires string costs a cached parse and set lookups
+    item_names = set()
+    categories = set()
+    for item in rows(items):
+        if isinstance(item, dict) and "name" in item:
+            item_names.add(item["name"])
+            categories.update(item.get("category", None) or [])
+    for event in rows(jsons.get("data/events.json")):
+        if isinstance(event, dict) and "name" in event:
+            item_names.add(event["name"])
+    # None means the rules modules couldn't be read completely, any function might exist
+    known_functions = set(functions) if functions is not None else None
+
+    sources = []
+    for location in rows(jsons.get("data/locations.json")):
+        if isinstance(location, dict) and "requires" in location:
+            sources.append(("data/locations.json", location.get("name", "?"), location["requires"]))
+    regions = jsons.get("data/regions.json")
+    if isinstance(regions, dict):
+        for name, region in regions.items():
+            if not isinstance(region, dict):
+                continue
+            if "requires" in region:
+                sources.append(("data/regions.json", name, region["requires"]))
+            for key in ("exit_requires", "entrance_requires"):
+                if isinstance(region.get(key, None), dict):
+                    for other, requires in region[key].items():
+                        sources.append(("data/regions.json", f"{name} {key} {other}", requires))
+
+    problems: dict[str, defaultdict[str, list[str]]] = defaultdict(lambda: defaultdict(list))
+    for fn, owner, requires in sources:
+        for parsed in iter_requires(requires):
+            for name in parsed.items:
+                if name not in item_names:
+                    problems[fn][f"Unknown item |{name}| used by"].append(owner)
+            for name in parsed.categories:
+                if name not in categories:
+                    problems[fn][f"Unknown category |@{name}| used by"].append(owner)
+            for name in parsed.functions:
+                if known_functions is not None and name not in known_functions:
+                    problems[fn][f"Unknown function {{{name}()}} used by"].append(owner)
+            for error in parsed.errors:
+                problems[fn][f"Invalid requires ({error}) in"].append(owner)
+
+    for fn, found in problems.items():
+        report.errors.setdefault(fn, []).extend(truncate(f"{problem} {', '.join(owners)}") for problem, owners in found.items())
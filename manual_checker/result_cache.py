@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+import time
+
+from .report import Report
+
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def cache_key(digest: str, filename: str) -> str:
+    # The folder structure check and the error keys use the file's name, renaming a file can change its report
+    return hashlib.sha256(f"{digest}\n{filename}".encode()).hexdigest()
+
+
+class ResultCache:
+    # Reports are stored by the sha256 of the apworld bytes and its filename (see cache_key).  An entry is only reused while the set of known base
+    # versions (the generation) is unchanged and none of the schemas it was validated against have been reloaded
+    # with different content.
+    def __init__(self, directory: str = os.path.join("cache", "results")) -> None:
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str, generation: str, schema_digests: dict[str, str]) -> Report | None:
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if entry.get("generation") != generation:
+            return None
+        for url, schema_digest in entry.get("schemas", {}).items():
+            if schema_digests.get(url, schema_digest) != schema_digest:
+                return None
+        # Hits keep their entry at the back of the line for prune
+        os.utime(self._path(key))
+        return Report.from_dict(entry["report"])
+
+    def put(self, key: str, generation: str, schemas: dict[str, str], report: Report) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"generation": generation, "schemas": schemas, "report": report.to_dict()}, f)
+        os.replace(path + ".tmp", path)
+
+    def prune(self, ttl: float, max_bytes: int) -> None:
+        # Drops entries unused for longer than ttl, then the least recently used ones until the rest fits in max_bytes
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort(reverse=True)
+        cutoff = time.time() - ttl
+        total = 0
+        for mtime, size, path in entries:
+            total += size
+            if mtime < cutoff or total > max_bytes:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
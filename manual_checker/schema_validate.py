@@ -1,54 +1,138 @@
+import asyncio
+import hashlib
 import json
+import os
+import time
+
 import aiohttp
 import jsonschema
-from jsonschema.exceptions import ValidationError
+from jsonschema.exceptions import SchemaError, ValidationError
+
+from shared import configuration, http_client, metrics
 
 SCHEMAS = {}
+SCHEMA_DIGESTS = {}
+SCHEMA_META = {}
+VALIDATORS = {}
+
+SCHEMA_BASE_URL = "https://raw.githubusercontent.com/ManualForArchipelago/Manual/main/schemas/"
+STANDARD_TABLES = ["game", "items", "locations", "regions", "categories", "options", "meta"]
+CACHE_DIRECTORY = os.path.join("cache", "schemas")
+# Set by the command line checker, only schemas that are already cached or loaded get used
+OFFLINE = False
+
+
+def schema_url(schema_table_name: str) -> str:
+    return SCHEMA_BASE_URL + "Manual." + schema_table_name + ".schema.json"
 
 async def validate_json(schema_table_name, table):
-    errors = []
-    githubSchemaBaseUrl = "https://raw.githubusercontent.com/ManualForArchipelago/Manual/main/schemas/"
-    schema = None
+    url = await resolve_schema(schema_table_name, table)
+    return validate_table(schema_table_name, table, SCHEMAS.get(url), SCHEMA_DIGESTS.get(url))
+
+async def resolve_schema(schema_table_name, table) -> str | None:
     if isinstance(table, dict) and table.get("$schema"):
         url = table["$schema"]
         if await download_schema(schema_table_name, url):
-            schema = SCHEMAS[url]
-    if not schema:
-        url = githubSchemaBaseUrl + "Manual." + schema_table_name + ".schema.json"
-        await download_schema(schema_table_name, url)
+            return url
+    url = schema_url(schema_table_name)
+    if await download_schema(schema_table_name, url):
+        return url
+    return None
+
+async def prefetch_schemas() -> None:
+    await asyncio.gather(*(download_schema(table, schema_url(table)) for table in STANDARD_TABLES))
+
+def get_validator(schema: dict, digest: str | None = None) -> jsonschema.protocols.Validator:
+    # Compiled once per schema and process, the analysis workers keep their own copy
+    key = digest or hashlib.sha256(json.dumps(schema, sort_keys=True).encode()).hexdigest()
+    validator = VALIDATORS.get(key)
+    if validator is None:
+        cls = jsonschema.validators.validator_for(schema)
+        cls.check_schema(schema)
+        validator = VALIDATORS[key] = cls(schema)
+    return validator
 
-    schema = SCHEMAS.get(url, None)
+def validate_table(schema_table_name, table, schema: dict | None, digest: str | None = None) -> list[str]:
+    errors = []
     if schema:
         try:
-            jsonschema.validators.validate(instance=table, schema=schema)
-        except ValidationError as e:
-            print(f"Validation error for {schema_table_name}: {parseJsonSchemaException(e, table)}")
+            validator = get_validator(schema, digest)
+        except SchemaError as e:
+            print(f"Invalid schema for {schema_table_name}: {e.message}")
+            return [f"The schema for {schema_table_name} is invalid: {e.message}"]
+        for e in sorted(validator.iter_errors(table), key=lambda e: e.json_path):
             errors.append(parseJsonSchemaException(e, table))
+        if errors:
+            print(f"{len(errors)} validation errors for {schema_table_name}")
     return errors
 
+def _cache_path(url: str) -> str:
+    return os.path.join(CACHE_DIRECTORY, hashlib.sha256(url.encode()).hexdigest()[:32] + ".json")
+
+def load_cached_schema(url: str) -> bool:
+    try:
+        with open(_cache_path(url)) as f:
+            cached = json.load(f)
+        SCHEMAS[url] = json.loads(cached["text"])
+    except (FileNotFoundError, KeyError, json.JSONDecodeError):
+        return False
+    SCHEMA_DIGESTS[url] = hashlib.sha256(cached["text"].encode()).hexdigest()
+    SCHEMA_META[url] = {"etag": cached.get("etag"), "fetched_at": cached.get("fetched_at", 0), "text": cached["text"]}
+    return True
+
+def use_schema(url: str, text: str) -> None:
+    SCHEMAS[url] = json.loads(text)
+    SCHEMA_DIGESTS[url] = hashlib.sha256(text.encode()).hexdigest()
+    SCHEMA_META[url] = {"etag": None, "fetched_at": time.time(), "text": text}
+
+def store_schema(url: str, text: str, etag: str | None) -> None:
+    SCHEMA_META[url] = {"etag": etag, "fetched_at": time.time(), "text": text}
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    path = _cache_path(url)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"url": url, **SCHEMA_META[url]}, f)
+    os.replace(path + ".tmp", path)
+
 async def download_schema(schema_table_name, url):
-    if url in SCHEMAS:
+    if url not in SCHEMAS:
+        load_cached_schema(url)
+    if OFFLINE:
+        metrics.cache("schema", url in SCHEMAS)
+        return url in SCHEMAS
+    meta = SCHEMA_META.get(url, {})
+    fresh = url in SCHEMAS and time.time() - meta["fetched_at"] < configuration.get("schema_ttl", 6 * 60 * 60)
+    metrics.cache("schema", fresh)
+    if fresh:
         return True
+    headers = {"If-None-Match": meta["etag"]} if meta.get("etag") else {}
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status != 200:
-                    print(f"Could not fetch schema for {schema_table_name}")
-                    return False
-                SCHEMAS[url] = json.loads(await response.text())
+        async with http_client.client.get(url, headers) as response:
+            if response.status == 304:
+                store_schema(url, meta["text"], meta["etag"])
                 return True
+            if response.status != 200:
+                print(f"Could not fetch schema for {schema_table_name}")
+                return url in SCHEMAS
+            text = await response.text()
+            use_schema(url, text)
+            store_schema(url, text, response.headers.get("ETag"))
+            return True
     except aiohttp.InvalidUrlClientError:
         print(f"Invalid schema url for {schema_table_name}")
         return False
+    except aiohttp.ClientError:
+        # Offline or GitHub is having a bad day, a stale copy is better than nothing
+        print(f"Could not fetch schema for {schema_table_name}")
+        return url in SCHEMAS
     except json.JSONDecodeError:
         print(f"Invalid schema for {schema_table_name}")
-        return False
+        return url in SCHEMAS
 
 def parseJsonSchemaException(e: ValidationError, table: dict | list) -> str:
     json_path = e.json_path.lstrip('$.')
-    if isinstance(table, list):
+    if isinstance(table, list) and e.absolute_path:
         item = table[e.absolute_path[0]]
-        if "name" in item:
+        if isinstance(item, dict) and "name" in item:
             json_path = json_path.replace(f'[{e.absolute_path[0]}]', f'[{item["name"]}]')
     error = f"[{e.validator}] {json_path}: {e.message}"
     if e.validator == 'type':
@@ -0,0 +1,94 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Generic, TypeVar
+
+from shared import metrics
+
+T = TypeVar("T")
+
+
+class InFlight(Generic[T]):
+    # Callers asking for a key that is already being worked on wait for that run instead of starting another
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.running: dict[str, asyncio.Future[T]] = {}
+
+    async def run(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        future = self.running.get(key)
+        metrics.count("inflight_requests_total", queue=self.name, shared=future is not None)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self.running[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else might be waiting, that's not worth an "exception was never retrieved" warning
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.running[key]
+
+
+class WorkQueue:
+    # A fixed number of workers take jobs off a bounded queue, submit answers straight away whether the job got in
+    def __init__(self, name: str, workers: int, max_size: int) -> None:
+        self.name = name
+        self.workers = workers
+        self.queue: asyncio.Queue[tuple[Callable[[], Awaitable[Any]], asyncio.Future, float]] = asyncio.Queue(max_size)
+        self.tasks: set[asyncio.Task] = set()
+        self.active = 0
+
+    def start(self) -> None:
+        if self.tasks:
+            return
+        for _ in range(self.workers):
+            task = asyncio.create_task(self.work())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    def stop(self) -> None:
+        for task in list(self.tasks):
+            task.cancel()
+        # Cancelled workers only leave the set once they have finished, a start right after this must not wait on them
+        self.tasks.clear()
+
+    def submit(self, job: Callable[[], Awaitable[T]]) -> asyncio.Future[T] | None:
+        # None means the queue is full and the job was not accepted.  Workers are started by the first job, nothing
+        # else runs again when the extension is reloaded after a stop
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((job, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            metrics.count("queue_rejected_total", queue=self.name)
+            return None
+        metrics.gauge("queue_depth", self.queue.qsize(), queue=self.name)
+        return future
+
+    async def work(self) -> None:
+        while True:
+            job, future, queued = await self.queue.get()
+            metrics.observe("queue_wait_seconds", time.perf_counter() - queued, queue=self.name)
+            metrics.gauge("queue_depth", self.queue.qsize(), queue=self.name)
+            self.active += 1
+            metrics.gauge("queue_active", self.active, queue=self.name)
+            try:
+                if not future.cancelled():
+                    future.set_result(await job())
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            finally:
+                self.active -= 1
+                metrics.gauge("queue_active", self.active, queue=self.name)
+                self.queue.task_done()
@@ -1,47 +1,157 @@
 from collections import defaultdict, deque
+from typing import Any
+
 from manual_checker.report import Report
 
 
-def validate_regions(table: dict, report: Report) -> None:
+def validate_regions(table: dict, report: Report, locations: list | dict | None = None) -> None:
+    # Regions are numbered once and everything after that works on lists of indices, so the whole check is linear
+    # in the number of regions and connections.
+    names = [name for name, data in table.items() if name != "$schema" and isinstance(data, dict)]
+    index = {name: i for i, name in enumerate(names)}
+    edges: list[list[int]] = [[] for _ in names]
     starting = []
-    ignored = set()
     has_connections = False
-    for name, data in table.items():
-        if name == "$schema":
-            ignored.add(name)
-            continue
+    backlinks: defaultdict[str, list[str]] = defaultdict(list)
+    errors = []
+    for i, name in enumerate(names):
+        data = table[name]
         if data.get("starting", False):
-            starting.append(name)
-        if data.get("connects_to", []):
+            starting.append(i)
+        for region in data.get("connects_to", None) or []:
             has_connections = True
+            target = index.get(region)
+            if target is None:
+                backlinks[region].append(name)
+            else:
+                edges[i].append(target)
+        for key in ("exit_requires", "entrance_requires"):
+            requires = data.get(key, None)
+            if not isinstance(requires, dict):
+                continue
+            for region in requires:
+                if region not in index:
+                    errors.append(f"{name} has {key} for {region}, but {region} is not a defined region.")
+    for region, sources in backlinks.items():
+        errors.append(f"{','.join(sources)} links to {region}, but {region} is not a defined region.")
+
+    warnings = []
     if starting:
-        # Check that all regions are reachable
-        connected = starting.copy()
-        backlinks: defaultdict[str, list[str]] = defaultdict(list)
+        reachable = bytearray(len(names))
+        for i in starting:
+            reachable[i] = 1
         queue = deque(starting)
         while queue:
-            current = queue.popleft()
-            if current not in table:
-                report.errors.setdefault("regions.json", [])
-                bl = ','.join(backlinks[current])
-                report.errors["regions.json"].append(f"{bl} links to {current}, but {current} is not a defined region.")
-                continue
-            for region in table[current].get("connects_to", []):
-                backlinks[region].append(current)
-                if region not in connected:
-                    connected.append(region)
-                    queue.append(region)
-
+            for target in edges[queue.popleft()]:
+                if not reachable[target]:
+                    reachable[target] = 1
+                    queue.append(target)
 
-        unreachable = set(table.keys()) - set(connected) - ignored
+        unreachable = [name for i, name in enumerate(names) if not reachable[i]]
         if unreachable:
-            report.errors.setdefault("regions.json", [])
-            if connected == starting:
-                report.errors["regions.json"].append('All non-starting regions are unreachable.  Your "connects_to" might be backwards.')
-            error = f"Unreachable regions: {', '.join(unreachable)}"
-            if len(error) > 300:
-                error = error[:297] + "..."
-            report.errors["regions.json"].append(error)
+            if len(unreachable) == len(names) - len(set(starting)):
+                errors.append('All non-starting regions are unreachable.  Your "connects_to" might be backwards.')
+            errors.append(truncate(f"Unreachable regions: {', '.join(unreachable)}"))
+        warnings = find_traps(names, edges, reachable, starting, locations)
     elif has_connections:
-            report.errors.setdefault("regions.json", [])
-            report.errors["regions.json"].append('"connects_to" has been used, but there are no starting regions defined.  Without a starting region, everything is connected to everything.')
+        errors.append('"connects_to" has been used, but there are no starting regions defined.  Without a starting region, everything is connected to everything.')
+
+    if errors:
+        report.errors.setdefault("regions.json", []).extend(errors)
+    if warnings:
+        report.warnings.setdefault("regions.json", []).extend(warnings)
+
+
+def find_traps(names: list[str], edges: list[list[int]], reachable: bytearray, starting: list[int], locations: list | dict | None) -> list[str]:
+    # A component nothing leads out of can be entered but never left, so a player going there can't get back to
+    # the start.  Single regions like that are only suspicious when there is nothing to do in them either.
+    component, count = strongly_connected(edges, [i for i in range(len(names)) if reachable[i]])
+    leaves = [True] * count
+    members: list[list[int]] = [[] for _ in range(count)]
+    for i in range(len(names)):
+        if component[i] < 0:
+            continue
+        members[component[i]].append(i)
+        for target in edges[i]:
+            if component[target] != component[i]:
+                leaves[component[i]] = False
+    for i in starting:
+        leaves[component[i]] = False
+
+    has_locations = set()
+    for location in rows(locations):
+        if isinstance(location, dict) and location.get("region"):
+            has_locations.add(location["region"])
+
+    traps = []
+    dead_ends = []
+    for c in range(count):
+        if not leaves[c]:
+            continue
+        if len(members[c]) > 1:
+            traps.append(", ".join(names[i] for i in members[c]))
+        elif names[members[c][0]] not in has_locations:
+            dead_ends.append(names[members[c][0]])
+    warnings = [truncate(f"One-way trap, these regions can be entered but never left: {trap}") for trap in traps]
+    if dead_ends:
+        warnings.append(truncate(f"Dead-end regions with no exits and no locations: {', '.join(dead_ends)}"))
+    return warnings
+
+
+def strongly_connected(edges: list[list[int]], roots: list[int]) -> tuple[list[int], int]:
+    # Iterative Tarjan, returns the component of every node visited from roots (-1 for the rest) and the count
+    order = [-1] * len(edges)
+    low = [0] * len(edges)
+    component = [-1] * len(edges)
+    next_edge = [0] * len(edges)
+    on_stack = bytearray(len(edges))
+    stack: list[int] = []
+    counter = 0
+    count = 0
+    for root in roots:
+        if order[root] != -1:
+            continue
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+        work = [root]
+        while work:
+            node = work[-1]
+            targets = edges[node]
+            i = next_edge[node]
+            if i < len(targets):
+                next_edge[node] = i + 1
+                target = targets[i]
+                if order[target] == -1:
+                    order[target] = low[target] = counter
+                    counter += 1
+                    stack.append(target)
+                    on_stack[target] = 1
+                    work.append(target)
+                elif on_stack[target] and order[target] < low[node]:
+                    low[node] = order[target]
+                continue
+            work.pop()
+            if work and low[node] < low[work[-1]]:
+                low[work[-1]] = low[node]
+            if low[node] == order[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = 0
+                    component[member] = count
+                    if member == node:
+                        break
+                count += 1
+    return component, count
+
+
+def rows(table: Any) -> list:
+    # Tables are either a plain list or {"$schema": ..., "data": [...]}
+    if isinstance(table, dict) and isinstance(table.get("data"), list):
+        return table["data"]
+    return table if isinstance(table, list) else []
+
+
+def truncate(error: str, limit: int = 300) -> str:
+    return error if len(error) <= limit else error[:limit - 3] + "..."
@@ -0,0 +1,70 @@
+from collections import Counter, defaultdict
+from typing import NamedTuple
+
+
+class Match(NamedTuple):
+    version: str | None
+    closest: str | None
+    similarity: float
+
+
+class VersionIndex:
+    # Maps every (path, CRC) pair of the known releases to the versions containing it, so a lookup only touches
+    # the versions that share files with the upload instead of comparing against every release.
+    def __init__(self) -> None:
+        self.versions: dict[str, dict[str, int]] = {}
+        self._by_file: defaultdict[tuple[str, int], set[str]] = defaultdict(set)
+        self._by_name: defaultdict[str, set[str]] = defaultdict(set)
+
+    def __contains__(self, version: str) -> bool:
+        return version in self.versions
+
+    def add(self, version: str, checksums: dict[str, int]) -> None:
+        if version in self.versions:
+            self.remove(version)
+        self.versions[version] = checksums
+        for fn, checksum in checksums.items():
+            self._by_file[(fn, checksum)].add(version)
+            if '/' not in fn:
+                self._by_name[fn].add(version)
+
+    def remove(self, version: str) -> None:
+        for fn, checksum in self.versions.pop(version, {}).items():
+            self._by_file[(fn, checksum)].discard(version)
+            if '/' not in fn:
+                self._by_name[fn].discard(version)
+
+    def identify(self, checksums: dict[str, int]) -> Match:
+        # A version matches when every top-level file it shares with the upload has the same CRC.  Files in
+        # subfolders (hooks, data, docs) are expected to be edited, so they only count towards the similarity.
+        comparable: Counter[str] = Counter()
+        matching: Counter[str] = Counter()
+        overlap: Counter[str] = Counter()
+        for fn, checksum in checksums.items():
+            versions = self._by_file.get((fn, checksum), ())
+            overlap.update(versions)
+            if '/' not in fn:
+                comparable.update(self._by_name.get(fn, ()))
+                matching.update(versions)
+
+        def similarity(version: str) -> float:
+            return overlap[version] / (len(checksums) + len(self.versions[version]) - overlap[version])
+
+        def rank(version: str) -> tuple[float, int]:
+            return similarity(version), numeric_version(version)
+
+        exact = [version for version, count in matching.items() if count == comparable[version]]
+        if exact:
+            best = max(exact, key=rank)
+            return Match(best, best, similarity(best))
+        if overlap:
+            closest = max(overlap, key=rank)
+            return Match(None, closest, similarity(closest))
+        return Match(None, None, 0.0)
+
+
+def numeric_version(version: str) -> int:
+    try:
+        return int(version.split('_')[-1])
+    except ValueError:
+        return 0
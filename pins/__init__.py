@@ -1,35 +1,66 @@
+import sentry_sdk
 from interactions.models import listen, Extension, ThreadChannel
-from interactions.api.events import MessageReactionAdd, MessageReactionRemove
-from interactions.client.utils import misc_utils
+from interactions.api.events import MessageReactionAdd, MessageReactionRemove, MessageReactionRemoveAll, MessageReactionRemoveEmoji
+from interactions.client.errors import HTTPException
+
+from shared import configuration, metrics
+
+from .tracker import PinTracker
+
+PIN = '📌'
+
 
 class Pins(Extension):
+    def __init__(self, bot) -> None:
+        self.tracker = PinTracker(self.set_pinned, configuration.get("pin_debounce", 3.0))
+
     @listen()
     async def on_message_reaction_add(self, event: MessageReactionAdd) -> None:
-        if not can_pin(event):
+        if event.emoji.name != PIN or not tracked_thread(event.message.channel):
             return
-        if event.emoji.name == '📌':
-            await event.message.pin()
+        self.tracker.added((event.message._channel_id, event.message.id), event.reaction_count, is_owner(event))
 
     @listen()
     async def on_message_reaction_remove(self, event: MessageReactionRemove) -> None:
-        if not can_pin(event):
+        if event.emoji.name != PIN or not tracked_thread(event.message.channel):
             return
-        if event.emoji.name == '📌':
-            reaction = misc_utils.find(lambda r: r.emoji.name == '📌', event.message.reactions)
-            if reaction and reaction.count > 1:
-                return
-            # raw fires before count is updated, so this is off-by-one if it's in the cache (but not if we fetched it)
-            await event.message.unpin()
+        self.tracker.removed((event.message._channel_id, event.message.id), event.reaction_count, is_owner(event))
 
+    @listen()
+    async def on_message_reaction_remove_all(self, event: MessageReactionRemoveAll) -> None:
+        self.tracker.cleared((event.message._channel_id, event.message.id))
 
-def can_pin(event: MessageReactionAdd | MessageReactionRemove) -> bool:
-    channel = event.message.channel
+    @listen()
+    async def on_message_reaction_remove_emoji(self, event: MessageReactionRemoveEmoji) -> None:
+        if event.emoji.name == PIN:
+            self.tracker.cleared((event.message._channel_id, event.message.id))
+
+    async def set_pinned(self, channel_id: int, message_id: int, pinned: bool) -> bool:
+        metrics.count("pin_requests_total", action="pin" if pinned else "unpin")
+        try:
+            if pinned:
+                await self.bot.http.pin_message(channel_id, message_id)
+            else:
+                await self.bot.http.unpin_message(channel_id, message_id)
+        except HTTPException as e:
+            # Most likely the 50 pin limit or a deleted message
+            sentry_sdk.capture_exception(e)
+            return False
+        return True
+
+
+def tracked_thread(channel) -> bool:
     if not isinstance(channel, ThreadChannel):
         return False
     if channel.parent_channel.category.id != 1097565035066298378:
         # Hardcoded reference to the "Games in Manual" category
         return False
-    if event.author.id != channel.owner_id:
+    return True
+
+
+def is_owner(event: MessageReactionAdd | MessageReactionRemove) -> bool:
+    # Only the thread owner reacting to their own message pins or unpins it, everyone else is only counted
+    if event.author.id != event.message.channel.owner_id:
         return False
     if event.author.id != event.message._author_id:
         return False
@@ -0,0 +1,79 @@
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+import attrs
+
+
+@attrs.define()
+class PinState:
+    # count is how many users have the pin reaction right now, as far as the gateway has told us
+    count: int = 0
+    wanted: bool | None = None
+    pinned: bool | None = None
+    deadline: float = 0.0
+    task: asyncio.Task | None = None
+
+
+class PinTracker:
+    # Reaction counts come from the gateway events alone, so deciding never needs the message's (possibly stale)
+    # reactions or a fetch.  Owner toggles only set the wanted state, which is applied once they have stopped for
+    # `delay` seconds, and only when it differs from what was last sent.
+    def __init__(self, apply: Callable[[int, int, bool], Awaitable[bool]], delay: float, max_entries: int = 2048) -> None:
+        self.apply = apply
+        self.delay = delay
+        self.max_entries = max_entries
+        self.states: OrderedDict[tuple[int, int], PinState] = OrderedDict()
+
+    def update(self, message: tuple[int, int], change: int, count: int | None) -> PinState:
+        state = self.states.get(message)
+        if state is None:
+            # First time we hear of this message, the event's own count (which already includes the change) is the
+            # best starting point there is
+            state = self.states[message] = PinState(count=max(0, count or 0))
+            while len(self.states) > self.max_entries and self.states[next(iter(self.states))].task is None:
+                self.states.popitem(last=False)
+        else:
+            state.count = max(0, state.count + change)
+            self.states.move_to_end(message)
+        return state
+
+    def added(self, message: tuple[int, int], count: int | None, by_owner: bool) -> None:
+        state = self.update(message, 1, count)
+        if by_owner:
+            self.want(message, state, True)
+
+    def removed(self, message: tuple[int, int], count: int | None, by_owner: bool) -> None:
+        state = self.update(message, -1, count)
+        if by_owner:
+            # Somebody else still having the reaction keeps it pinned
+            self.want(message, state, state.count > 0)
+
+    def cleared(self, message: tuple[int, int]) -> None:
+        if state := self.states.get(message):
+            state.count = 0
+
+    def want(self, message: tuple[int, int], state: PinState, pinned: bool) -> None:
+        loop = asyncio.get_running_loop()
+        state.wanted = pinned
+        state.deadline = loop.time() + self.delay
+        if state.task is None:
+            state.task = loop.create_task(self.settle(message, state))
+
+    async def settle(self, message: tuple[int, int], state: PinState) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                while (remaining := state.deadline - loop.time()) > 0:
+                    await asyncio.sleep(remaining)
+                pinned = state.wanted
+                if pinned == state.pinned:
+                    return
+                deadline = state.deadline
+                # apply reports whether the request went through, a failed one leaves the state unknown
+                state.pinned = pinned if await self.apply(*message, pinned) else None
+                if state.deadline == deadline:
+                    return
+                # Toggled again while the request was out, that change gets a window of its own
+        finally:
+            state.task = None
@@ -1,3 +1,5 @@
 from discordbot import main
 
-main.init()
+if __name__ == "__main__":
+    # Guarded so the analysis worker processes can re-import the main module safely
+    main.init()
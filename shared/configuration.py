@@ -1,12 +1,9 @@
 import inspect
 import json
 import os
-import random
-import string
+import threading
 from typing import Any
 
-from interactions import MISSING
-
 from .exceptions import InvalidArgumentException
 
 DEFAULTS = {
@@ -14,40 +11,84 @@ DEFAULTS = {
     "owners": [154363842451734528, 222352614832996354]
 }
 
-def get(key: str, default=MISSING) -> Any:
-    try:
-        cfg = json.load(open('config.json'))
-    except FileNotFoundError:
-        cfg = {}
-    if key in cfg:
-        return cfg[key]
-    elif key in os.environ:
-        cfg[key] = os.environ[key]
-    elif default is not MISSING:
-        cfg[key] = default
-    elif key in DEFAULTS:
-        # Lock in the default value if we use it.
-        cfg[key] = DEFAULTS[key]
-
-        if inspect.isfunction(cfg[key]): # If default value is a function, call it.
-            cfg[key] = cfg[key]()
-    else:
-        raise InvalidArgumentException('No default or other configuration value available for {key}'.format(key=key))
-
-    print("CONFIG: {0}={1}".format(key, cfg[key]))
-    fh = open('config.json', 'w')
-    fh.write(json.dumps(cfg, indent=4))
-    return cfg[key]
-
-def write(key: str, value: str) -> str:
+CONFIG_PATH = 'config.json'
+
+# Stands in for "no default given", None is a perfectly good default
+MISSING = object()
+
+# config.json is read once and served from memory.  A stat per lookup notices edits made outside the process.
+_lock = threading.Lock()
+_cfg: dict[str, Any] | None = None
+_mtime: int | None = None
+# Set while config.json doesn't parse, writing then would throw away the edit that is in progress
+_error: json.JSONDecodeError | None = None
+
+def _load() -> dict[str, Any]:
+    global _cfg, _mtime, _error
     try:
-        cfg = json.load(open('config.json'))
+        mtime = os.stat(CONFIG_PATH).st_mtime_ns
     except FileNotFoundError:
-        cfg = {}
+        mtime = None
+    if _cfg is None or mtime != _mtime:
+        if mtime is None:
+            _cfg = {}
+        else:
+            try:
+                with open(CONFIG_PATH) as fh:
+                    _cfg = json.load(fh)
+            except json.JSONDecodeError as e:
+                # Probably caught halfway through a manual edit, keep what we had and try again next time
+                print("CONFIG: could not parse {0}: {1}".format(CONFIG_PATH, e))
+                _error = e
+                if _cfg is None:
+                    _cfg = {}
+                return _cfg
+        _mtime = mtime
+        _error = None
+    return _cfg
 
-    cfg[key] = value
+def _save(cfg: dict[str, Any]) -> None:
+    global _mtime
+    tmp = CONFIG_PATH + '.tmp'
+    with open(tmp, 'w') as fh:
+        fh.write(json.dumps(cfg, indent=4))
+    os.replace(tmp, CONFIG_PATH)
+    _mtime = os.stat(CONFIG_PATH).st_mtime_ns
 
-    print("CONFIG: {0}={1}".format(key, cfg[key]))
-    fh = open('config.json', 'w')
-    fh.write(json.dumps(cfg, indent=4, sort_keys=True))
-    return cfg[key]
+def get(key: str, default=MISSING) -> Any:
+    with _lock:
+        cfg = _load()
+        if key in cfg:
+            return cfg[key]
+        elif key in os.environ:
+            value = os.environ[key]
+        elif default is not MISSING:
+            value = default
+        elif key in DEFAULTS:
+            # Lock in the default value if we use it.
+            value = DEFAULTS[key]
+
+            if inspect.isfunction(value): # If default value is a function, call it.
+                value = value()
+        else:
+            raise InvalidArgumentException('No default or other configuration value available for {key}'.format(key=key))
+
+        print("CONFIG: {0}={1}".format(key, value))
+        cfg[key] = value
+        if _error is None:
+            _save(cfg)
+        return value
+
+def write(key: str, value: Any) -> Any:
+    with _lock:
+        cfg = _load()
+        if key in cfg and cfg[key] == value:
+            return value
+
+        if _error is not None:
+            raise _error
+        cfg[key] = value
+
+        print("CONFIG: {0}={1}".format(key, cfg[key]))
+        _save(cfg)
+        return cfg[key]
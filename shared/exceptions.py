@@ -22,6 +22,9 @@ class TooManyItemsException(PDException):
 class TooFewItemsException(PDException):
     pass
 
+class FileTooLargeException(InvalidDataException):
+    pass
+
 class InvalidArgumentException(PDException):
     pass
 
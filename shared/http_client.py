@@ -0,0 +1,144 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import random
+import tempfile
+import time
+from typing import Any, AsyncIterator
+
+import aiohttp
+
+from . import configuration
+from .exceptions import FileTooLargeException
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Whatever a server asks for, a single wait is never longer than this
+MAX_RETRY_DELAY = 60.0
+
+
+class HttpClient:
+    # One keep-alive connection pool for everything the bot downloads.  Requests are capped per host by the
+    # connector, and rate limits / server errors are retried with exponential backoff.
+    def __init__(
+        self,
+        limit: int | None = None,
+        limit_per_host: int | None = None,
+        timeout: float | None = None,
+        retries: int | None = None,
+        backoff: float | None = None,
+        retry_budget: float | None = None,
+    ) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_budget = retry_budget
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            # Settings are read here rather than at import so the analysis workers never touch config.json
+            if self.limit is None:
+                self.limit = configuration.get("http_connection_limit", 20)
+            if self.limit_per_host is None:
+                self.limit_per_host = configuration.get("http_connection_limit_per_host", 4)
+            if self.timeout is None:
+                self.timeout = configuration.get("http_timeout", 60)
+            if self.retries is None:
+                self.retries = configuration.get("http_retries", 3)
+            if self.backoff is None:
+                self.backoff = configuration.get("http_backoff", 1.0)
+            if self.retry_budget is None:
+                self.retry_budget = configuration.get("http_retry_budget", 120.0)
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    @contextlib.asynccontextmanager
+    async def get(self, url: str, headers: dict[str, str] | None = None) -> AsyncIterator[aiohttp.ClientResponse]:
+        session = self.session
+        attempt = 0
+        # Some of these URLs come from uploads, a server can't keep a check waiting for longer than the budget
+        deadline = time.monotonic() + self.retry_budget
+        while True:
+            try:
+                response = await session.get(url, headers=headers)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                delay = self.retry_delay(None, attempt)
+                if attempt >= self.retries or time.monotonic() + delay > deadline:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            if attempt < self.retries and is_retryable(response) and time.monotonic() + (delay := self.retry_delay(response, attempt)) <= deadline:
+                response.release()
+                print(f"HTTP {response.status} from {url}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            break
+        try:
+            yield response
+        finally:
+            response.release()
+
+    async def read(self, url: str, headers: dict[str, str] | None = None) -> bytes:
+        async with self.get(url, headers) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def json(self, url: str, headers: dict[str, str] | None = None) -> Any:
+        async with self.get(url, headers) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def download(self, url: str, path: str, max_size: int | None = None, chunk_size: int = 64 * 1024) -> str:
+        # Streams into a temporary file next to the destination and hashes as it goes, so the content never sits
+        # in memory as a whole and a half-written or oversized download never appears at `path`.
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async with self.get(url) as response:
+                    response.raise_for_status()
+                    if max_size is not None and (response.content_length or 0) > max_size:
+                        raise FileTooLargeException(f"{url} is {response.content_length} bytes, the limit is {max_size}")
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        size += len(chunk)
+                        if max_size is not None and size > max_size:
+                            raise FileTooLargeException(f"{url} exceeded the limit of {max_size} bytes")
+                        digest.update(chunk)
+                        f.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(temp_path)
+            raise
+        return digest.hexdigest()
+
+    def retry_delay(self, response: aiohttp.ClientResponse | None, attempt: int) -> float:
+        if response is not None:
+            if response.headers.get("Retry-After", "").isdigit():
+                return min(float(response.headers["Retry-After"]), MAX_RETRY_DELAY)
+            if response.headers.get("X-RateLimit-Reset", "").isdigit():
+                return min(max(0.0, int(response.headers["X-RateLimit-Reset"]) - time.time()), MAX_RETRY_DELAY)
+        return self.backoff * 2**attempt + random.uniform(0, self.backoff)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+def is_retryable(response: aiohttp.ClientResponse) -> bool:
+    if response.status in RETRY_STATUSES:
+        return True
+    # GitHub reports an exhausted rate limit as a 403
+    return response.status == 403 and response.headers.get("X-RateLimit-Remaining") == "0"
+
+
+client = HttpClient()
@@ -0,0 +1,175 @@
+import asyncio
+import contextlib
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Iterator
+
+import sentry_sdk
+
+from . import configuration
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self) -> None:
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+
+class Metrics:
+    # Everything is kept in process and costs a dict update per call.  Spans also go to Sentry, and the totals can
+    # be scraped from a local Prometheus text endpoint or written to a textfile, neither of which needs an outside
+    # service.
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters: defaultdict[tuple[str, Labels], float] = defaultdict(float)
+        self.gauges: dict[tuple[str, Labels], float] = {}
+        self.histograms: dict[tuple[str, Labels], Histogram] = {}
+
+    def count(self, name: str, value: float = 1, **labels: Any) -> None:
+        with self._lock:
+            self.counters[(name, _labels(labels))] += value
+
+    def gauge(self, name: str, value: float, **labels: Any) -> None:
+        with self._lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def cache(self, cache: str, hit: bool) -> None:
+        self.count("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+    @contextlib.contextmanager
+    def span(self, stage: str, **data: Any) -> Iterator[Any]:
+        # Becomes a transaction of its own when nothing is being traced yet (scheduled tasks, gateway events)
+        if sentry_sdk.get_current_span() is None:
+            context = sentry_sdk.start_transaction(op=stage, name=stage)
+        else:
+            context = sentry_sdk.start_span(op=stage, name=stage)
+        start = time.perf_counter()
+        with context as span:
+            for key, value in data.items():
+                span.set_data(key, value)
+            try:
+                yield span
+            except Exception as e:
+                self.count("stage_errors_total", stage=stage, error=type(e).__name__)
+                raise
+            finally:
+                self.observe("stage_duration_seconds", time.perf_counter() - start, stage=stage)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for kind, values in (("counter", self.counters), ("gauge", self.gauges)):
+                previous = None
+                for (name, labels), value in sorted(values.items()):
+                    if name != previous:
+                        lines.append(f"# TYPE {name} {kind}")
+                        previous = name
+                    lines.append(f"{name}{_format(labels)} {value:g}")
+            previous = None
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if name != previous:
+                    lines.append(f"# TYPE {name} histogram")
+                    previous = name
+                for bound, count in zip(BUCKETS, histogram.buckets):
+                    lines.append(f"{name}_bucket{_format(labels + (('le', f'{bound:g}'),))} {count}")
+                lines.append(f"{name}_bucket{_format(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{_format(labels)} {histogram.sum:g}")
+                lines.append(f"{name}_count{_format(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
+span = metrics.span
+count = metrics.count
+gauge = metrics.gauge
+observe = metrics.observe
+cache = metrics.cache
+
+_tasks: set[asyncio.Task] = set()
+
+
+async def sample_loop_lag(interval: float) -> None:
+    # A sleep that wakes up late means something held the event loop, and with it the gateway connection
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        metrics.gauge("event_loop_lag_last_seconds", lag)
+        metrics.observe("event_loop_lag_seconds", lag)
+
+
+async def write_textfile(path: str, interval: float) -> None:
+    # Same format as the endpoint, for node_exporter's textfile collector or simply reading the file
+    while True:
+        await asyncio.sleep(interval)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            f.write(metrics.render())
+        os.replace(path + ".tmp", path)
+
+
+async def serve(host: str, port: int) -> None:
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+
+
+async def start() -> None:
+    if _tasks:
+        return
+    _background(sample_loop_lag(configuration.get("loop_lag_interval", 1.0)))
+    if textfile := configuration.get("metrics_textfile", None):
+        _background(write_textfile(textfile, configuration.get("metrics_textfile_interval", 60)))
+    if port := configuration.get("metrics_port", None):
+        await serve(configuration.get("metrics_host", "127.0.0.1"), port)
+
+
+def _background(coro) -> None:
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
@@ -0,0 +1,131 @@
+import asyncio
+import inspect
+import time
+from typing import Any, Awaitable, Callable
+
+from . import configuration, metrics
+
+PENDING = "pending"
+RUNNING = "running"
+READY = "ready"
+FAILED = "failed"
+
+
+class Component:
+    def __init__(self, name: str, func: Callable[[], Any | Awaitable[Any]], priority: int, after: tuple[str, ...]) -> None:
+        self.name = name
+        self.func = func
+        self.priority = priority
+        self.after = after
+        self.state = PENDING
+        self.started = asyncio.Event()
+        self.done = asyncio.Event()
+        self.seconds: float | None = None
+
+
+class Startup:
+    # Extensions register their warm-up work when they are loaded and it all runs in the background once the bot has
+    # connected, lowest priority number first and never more than startup_concurrency at a time.  Anything that needs
+    # a component can wait for it, a failed component counts as done so nobody waits forever.
+    def __init__(self) -> None:
+        self.began = time.perf_counter()
+        self.components: dict[str, Component] = {}
+        self.responded: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._limit: asyncio.Semaphore | None = None
+
+    def add(self, name: str, func: Callable[[], Any | Awaitable[Any]], priority: int = 0, after: tuple[str, ...] = ()) -> None:
+        for dependency in after:
+            if dependency in self.components and self.components[dependency].priority > priority:
+                raise ValueError(f"{name} can't wait for {dependency}, it has a lower priority")
+        existing = self.components.get(name)
+        if existing is not None and (existing.state != PENDING or self._limit is not None):
+            # A reloaded extension registers again, what already ran (or is running) still stands.  One that is
+            # still waiting for its turn already has a task, it runs the new registration's function instead.
+            if existing.state == PENDING:
+                existing.func = func
+            return
+        component = self.components[name] = Component(name, func, priority, after)
+        metrics.gauge("startup_component_ready", 0, component=name)
+        if self._limit is not None:
+            # Registered after start, nothing else would ever run it
+            self._launch(component)
+
+    def start(self) -> None:
+        if self._limit is not None:
+            return
+        self._limit = asyncio.Semaphore(configuration.get("startup_concurrency", 2))
+        for component in sorted(self.components.values(), key=lambda component: component.priority):
+            self._launch(component)
+
+    def _launch(self, component: Component) -> None:
+        task = asyncio.create_task(self.run(component, self._limit))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def run(self, component: Component, limit: asyncio.Semaphore) -> None:
+        # Waiting for everything more important to have started keeps a dependency wait from letting less important
+        # work take its slot
+        for other in self.components.values():
+            if other.priority < component.priority:
+                await other.started.wait()
+        for name in component.after:
+            if name in self.components:
+                await self.components[name].done.wait()
+        async with limit:
+            component.state = RUNNING
+            component.started.set()
+            start = time.perf_counter()
+            try:
+                with metrics.span(f"startup.{component.name}"):
+                    result = component.func()
+                    if inspect.isawaitable(result):
+                        await result
+            except Exception as e:
+                component.state = FAILED
+                print(f"Startup: {component.name} failed: {e!r}")
+            else:
+                component.state = READY
+                metrics.gauge("startup_component_ready", 1, component=component.name)
+            finally:
+                component.seconds = time.perf_counter() - start
+                metrics.gauge("startup_component_seconds", component.seconds, component=component.name)
+                metrics.gauge("startup_component_done_seconds", time.perf_counter() - self.began, component=component.name)
+                component.done.set()
+        print(f"Startup: {component.name} {component.state} after {component.seconds:.1f}s")
+
+    async def wait(self, name: str, timeout: float | None = None) -> bool:
+        # True once the component is done (or was never registered), False when the timeout ran out first
+        component = self.components.get(name)
+        if component is None or component.done.is_set():
+            return True
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(component.done.wait(), timeout)
+            result = True
+        except asyncio.TimeoutError:
+            result = False
+        metrics.count("startup_waits_total", component=name, result="done" if result else "timeout")
+        metrics.observe("startup_wait_seconds", time.perf_counter() - start, component=name)
+        return result
+
+    def state(self, name: str) -> str | None:
+        component = self.components.get(name)
+        return component.state if component else None
+
+    def responded_to(self, kind: str) -> None:
+        # The first answer of each kind after a restart is the time a user actually waited for the bot to be useful
+        if kind in self.responded:
+            return
+        self.responded.add(kind)
+        seconds = time.perf_counter() - self.began
+        metrics.gauge("startup_first_response_seconds", seconds, kind=kind)
+        print(f"Startup: first {kind} {seconds:.1f}s after start")
+
+
+startup = Startup()
+add = startup.add
+start = startup.start
+wait = startup.wait
+state = startup.state
+responded_to = startup.responded_to